@@ -0,0 +1,52 @@
+# Frame time of the sprite renderer versus SVG rasterization with cairosvg and the pixel difference between them.
+#
+# usage: python benchmarks/board_renderer.py [size] [frames]
+
+import io
+import sys
+import time
+
+import numpy as np
+import chess
+import chess.svg
+from PIL import Image
+
+from chesslab.apps import convert_svg_to_png
+from chesslab.apps.board_renderer import SpriteRenderer
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    game = [chess.Board()]
+    for uci in "e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7 f1e1 b7b5 a4b3 d7d6 c2c3 e8g8".split():
+        game.append(game[-1].copy())
+        game[-1].push_uci(uci)
+
+    start = time.perf_counter()
+    for i in range(frames):
+        svg_png = convert_svg_to_png(chess.svg.board(game[i % len(game)], size=size)).getvalue()
+    svg_time = (time.perf_counter() - start) / frames
+
+    renderer = SpriteRenderer()
+    start = time.perf_counter()
+    renderer.render(game[0], size)
+    first_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(frames):
+        sprite_png = renderer.render(game[i % len(game)], size)
+    sprite_time = (time.perf_counter() - start) / frames
+
+    board = game[(frames - 1) % len(game)]
+    expected = np.asarray(Image.open(io.BytesIO(convert_svg_to_png(chess.svg.board(board, size=size)).getvalue())).convert('RGB'))
+    diff = np.abs(np.asarray(Image.open(io.BytesIO(sprite_png))).astype(int) - expected.astype(int))
+
+    print(f"svg: {1000 * svg_time:.1f} ms/frame, {len(svg_png)} bytes")
+    print(f"sprites: {1000 * sprite_time:.1f} ms/frame, {len(sprite_png)} bytes, first frame {1000 * first_time:.0f} ms")
+    print(f"pixel difference mean={diff.mean():.3f} max={diff.max()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# Time the ChessWorld engine takes to answer a human move with and without pondering on the predicted reply.
+# The human plays the reply the engine predicted with probability of prediction, a random legal move otherwise.
+#
+# usage: python benchmarks/chessworld_ponder.py <engine path> [moves] [think time] [rating] [prediction]
+
+import sys
+import time
+import random
+
+from chesslab.apps import MainApp
+from chesslab.apps.chessworld import ChessWorld
+from chesslab.apps.chessworld.ponder import ponderer
+from chesslab.engine import engine_pool
+from chesslab.engine.cache import analysis_cache
+
+
+def play(engine_path, ponder, moves, think, rating, prediction):
+    rng = random.Random(0)
+    analysis_cache.clear()
+    app = ChessWorld(MainApp())
+    app.book = False
+    app.engine_path = engine_path
+    app.my = 'white'
+    app.ponder = ponder
+    app.resigned = True
+    list(app.execute('new', ''))
+    app.limit = app.parse_limit('nodes', app.rating2nodes(rating))
+    hits = misses = 0
+
+    latencies = []
+    while len(latencies) < moves:
+        if app.fixed_outcome() is not None:
+            # a new game resets the counts
+            hits += ponderer.hits
+            misses += ponderer.misses
+            app.resigned = True
+            list(app.execute('new', ''))
+            app.limit = app.parse_limit('nodes', app.rating2nodes(rating))
+        time.sleep(think)
+
+        if ponderer.pondering is not None and rng.random() < prediction:
+            move = ponderer.pondering[0].move_stack[-1]
+        else:
+            move = rng.choice(list(app.board.legal_moves))
+
+        start = time.perf_counter()
+        list(app.execute(app.board.san(move), '', 'term'))
+        latencies.append(time.perf_counter() - start)
+
+    ponderer.stop()
+    return sorted(latencies), hits + ponderer.hits, misses + ponderer.misses
+
+
+def main():
+    engine_path = sys.argv[1]
+    moves = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    think = float(sys.argv[3]) if len(sys.argv) > 3 else 3.0
+    rating = int(sys.argv[4]) if len(sys.argv) > 4 else 2000
+    prediction = float(sys.argv[5]) if len(sys.argv) > 5 else 0.5
+
+    for ponder in (False, True):
+        latencies, hits, misses = play(engine_path, ponder, moves, think, rating, prediction)
+        print(f"ponder {'on' if ponder else 'off'}: median {latencies[len(latencies) // 2]:.3f}s, "
+              f"mean {sum(latencies) / len(latencies):.3f}s, max {latencies[-1]:.3f}s")
+    print(f"ponderhits={hits} misses={misses}")
+
+    ponderer.close()
+    engine_pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Per-move latency of popen-per-command engines versus the warm engine pool.
+#
+# usage: python benchmarks/engine_pool.py <engine path> [moves] [nodes]
+
+import sys
+import time
+
+import chess
+import numpy as np
+from chess.engine import Limit
+
+from chesslab.engine import ChesslabEngine, EnginePool
+
+
+def play(board, moves, analyse):
+    latencies = []
+    for _ in range(moves):
+        if board.is_game_over():
+            break
+        start = time.perf_counter()
+        lines = analyse(board)
+        latencies.append(time.perf_counter() - start)
+        board.push(lines[0].moves[0])
+
+    return np.array(latencies) * 1000
+
+
+def report(name, latencies):
+    print(f"{name:>8}: mean={latencies.mean():.1f} ms median={np.median(latencies):.1f} ms max={latencies.max():.1f} ms")
+
+
+def main():
+    path = sys.argv[1]
+    moves = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    limit = Limit(nodes=int(sys.argv[3]) if len(sys.argv) > 3 else 1000)
+
+    def popen(board):
+        with ChesslabEngine(path) as engine:
+            return engine.analyse(board, limit, 1)
+
+    pool = EnginePool()
+
+    def pooled(board):
+        with pool.lease(path, game='benchmark') as engine:
+            return engine.analyse(board, limit, 1)
+
+    report('popen', play(chess.Board(), moves, popen))
+    report('pool', play(chess.Board(), moves, pooled))
+    print(pool.stats())
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
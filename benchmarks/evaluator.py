@@ -0,0 +1,47 @@
+# Wall-clock time of evaluator.evaluate versus the multipv and parallel evaluators.
+# A depth limit is used, so every evaluator searches each move to the same depth and the work compared is equal.
+#
+# usage: python benchmarks/evaluator.py <engine path> [depth] [fen]
+
+import os
+import sys
+import time
+
+import chess
+from chess.engine import Limit
+
+from chesslab.engine import ChesslabEngine, engine_pool
+from chesslab.evaluator import evaluate, evaluate_multipv, evaluate_parallel, SimpleSelector
+
+MIDDLEGAME_FEN = "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP1B1PPP/R2QKB1R w KQ - 0 9"
+
+
+def timed(name, fn, base=None):
+    start = time.perf_counter()
+    evaluation = fn()
+    elapsed = time.perf_counter() - start
+    speedup = f" speedup={base / elapsed:.1f}x" if base else ""
+    print(f"{name:>14}: {elapsed:.2f} s moves={len(evaluation.eval_res)} best={SimpleSelector().select_move(evaluation)}{speedup}")
+    return elapsed
+
+
+def main():
+    path = sys.argv[1]
+    limit = Limit(depth=int(sys.argv[2]) if len(sys.argv) > 2 else 10)
+    board = chess.Board(sys.argv[3] if len(sys.argv) > 3 else MIDDLEGAME_FEN)
+    print(f"{board.legal_moves.count()} legal moves, {limit}")
+
+    with ChesslabEngine(path) as engine:
+        base = timed('evaluate', lambda: evaluate(board, engine, limit))
+        timed('multipv', lambda: evaluate_multipv(board, engine, limit), base)
+
+    workers = 1
+    while workers <= os.cpu_count():
+        timed(f'parallel x{workers}', lambda: evaluate_parallel(board, path, limit, workers=workers, options={'Threads': 1}), base)
+        workers *= 2
+
+    engine_pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# Engine time and score agreement of GameScore three-search mode versus single pass mode.
+#
+# usage: python benchmarks/game_score.py <engine path> [time per search] [game index] [pgn path]
+
+import sys
+import time
+
+import chess.pgn
+from chess.engine import SimpleEngine, Limit
+
+from chesslab.game_score import GameScore
+
+
+class CountingEngine:
+    def __init__(self, engine):
+        self.engine = engine
+        self.calls = 0
+        self.seconds = 0.0
+
+    def analyse(self, *args, **kwargs):
+        start = time.perf_counter()
+        res = self.engine.analyse(*args, **kwargs)
+        self.seconds += time.perf_counter() - start
+        self.calls += 1
+        return res
+
+
+def main():
+    path = sys.argv[1]
+    limit = Limit(time=float(sys.argv[2]) if len(sys.argv) > 2 else 0.1)
+    index = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    pgn_path = sys.argv[4] if len(sys.argv) > 4 else 'data/magnus_first.pgn'
+
+    with open(pgn_path) as pgn:
+        for _ in range(index + 1):
+            game = chess.pgn.read_game(pgn)
+
+    engine = SimpleEngine.popen_uci(path)
+    res = {}
+    for single_pass in (False, True):
+        counting = CountingEngine(engine)
+        res[single_pass] = GameScore(game, counting, limit, single_pass=single_pass).score()
+        print(f"single_pass={single_pass}: searches={counting.calls} engine time={counting.seconds:.1f} s score={res[single_pass]}")
+    engine.quit()
+
+    for color in ('white', 'black'):
+        print(f"{color} difference {abs(res[True][color] - res[False][color]):.2f}")
+
+
+if __name__ == "__main__":
+    main()
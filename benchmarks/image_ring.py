@@ -0,0 +1,63 @@
+# Latency of images sent from another process at a fixed frame rate, as when stepping through a game,
+# inline through multiprocessing.Queue versus through ImageRing with only handles in the queue.
+#
+# usage: python benchmarks/image_ring.py [image size in KB] [images] [frames per second]
+
+import os
+import sys
+import time
+from multiprocessing import Process, Queue
+
+from chesslab.image_ring import ImageRing
+
+
+def produce(out_queue, size, count, fps, ring_name):
+    image_ring = ImageRing(ring_name) if ring_name else None
+    data = os.urandom(size)
+    start = time.perf_counter()
+    for i in range(count):
+        time.sleep(max(0.0, start + i / fps - time.perf_counter()))
+        sent = time.perf_counter()
+        out_queue.put((image_ring.write(data) if image_ring is not None else data, sent))
+    out_queue.put(None)
+
+
+def consume(size, count, fps, image_ring=None):
+    out_queue = Queue()
+    producer = Process(target=produce, args=(out_queue, size, count, fps, image_ring.name if image_ring else None))
+    producer.start()
+    latencies = []
+    dropped = 0
+    while True:
+        item = out_queue.get()
+        if item is None:
+            break
+        image, sent = item
+        data = image_ring.read(image) if image_ring is not None else image
+        if data is None:
+            dropped += 1
+        else:
+            latencies.append(time.perf_counter() - sent)
+    producer.join()
+    latencies.sort()
+    return 1000 * sum(latencies) / len(latencies), 1000 * latencies[int(0.99 * (len(latencies) - 1))], dropped
+
+
+def main():
+    size = 1024 * (int(sys.argv[1]) if len(sys.argv) > 1 else 1024)
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    fps = float(sys.argv[3]) if len(sys.argv) > 3 else 60
+
+    mean, p99, _ = consume(size, count, fps)
+    print(f"queue: mean latency {mean:.2f} ms, p99 {p99:.2f} ms")
+
+    image_ring = ImageRing(slot_size=size + ImageRing.header.size)
+    try:
+        mean, p99, dropped = consume(size, count, fps, image_ring)
+    finally:
+        image_ring.close()
+    print(f"ring: mean latency {mean:.2f} ms, p99 {p99:.2f} ms, dropped {dropped}")
+
+
+if __name__ == '__main__':
+    main()
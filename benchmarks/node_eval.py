@@ -0,0 +1,109 @@
+# Cost of PosLab's Node.eval after a variation is played on a large synthetic tree:
+# clearing every score below the root as rewind did, versus clearing only the ancestors of changed nodes.
+#
+# usage: python benchmarks/node_eval.py [nodes] [variations]
+
+import sys
+import time
+import random
+
+import chess
+from chess.engine import PovScore, Cp
+
+from chesslab.engine import Line
+from chesslab.apps.poslab import Node
+
+MOVES = [chess.Move(from_square, to_square) for from_square, to_square in zip(range(0, 20), range(20, 40))]
+
+
+def variation(root, engine_color, rng, depth=40):
+    """
+    Play a random variation from root and back propagate its outcome like PosLab does,
+    returns the number of new nodes.
+    """
+    new = 0
+    node = root
+    for _ in range(rng.randint(depth // 2, depth)):
+        move = rng.choice(MOVES)
+        key = move.uci()
+        if key not in node.children:
+            child = Node(not node.turn)
+            if child.turn == engine_color:
+                child.lines = [Line({'score': PovScore(Cp(rng.randint(-300, 300)), child.turn),
+                                     'pv': [rng.choice(MOVES)]})]
+            node.add_child(key, child)
+            new += 1
+        child = node.children[key]
+        child.parent = node
+        node = child
+
+    if node.outcome is None and not node.children:
+        winner = rng.choice([chess.WHITE, chess.BLACK, None])
+        node.outcome = chess.Outcome(chess.Termination.VARIANT_WIN, winner)
+    if node.outcome is not None and node.outcome.winner != engine_color:
+        while node is not None:
+            node.human_success = True
+            node = node.parent
+    return new
+
+
+def tree(count, engine_color, rng):
+    root = Node(not engine_color)
+    size = 1
+    while size < count:
+        size += variation(root, engine_color, rng)
+    return root
+
+
+def walk(root):
+    stack, seen = [root], set()
+    while stack:
+        node = stack.pop()
+        if id(node) not in seen:
+            seen.add(id(node))
+            yield node
+            stack.extend(node.children.values())
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    variations = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    engine_color = chess.BLACK
+    rng = random.Random(0)
+
+    start = time.perf_counter()
+    root = tree(count, engine_color, rng)
+    print(f"tree of {sum(1 for _ in walk(root))} nodes built in {time.perf_counter() - start:.1f}s")
+    root.eval(engine_color)
+
+    full = incremental = 0.0
+    for _ in range(variations):
+        variation(root, engine_color, rng)
+
+        start = time.perf_counter()
+        score = root.eval(engine_color)
+        incremental += time.perf_counter() - start
+
+        start = time.perf_counter()
+        root.clear_evals()
+        assert root.eval(engine_color) == score
+        full += time.perf_counter() - start
+
+    print(f"eval after a variation, clearing the tree: {1000 * full / variations:.2f} ms")
+    print(f"eval after a variation, clearing ancestors: {1000 * incremental / variations:.3f} ms")
+
+    chain = node = Node(not engine_color)
+    for _ in range(100000):
+        child = Node(not node.turn)
+        child.lines = [Line({'score': PovScore(Cp(0), child.turn), 'pv': [MOVES[0]]})]
+        child.human_success = True
+        node.add_child(MOVES[1].uci(), child)
+        node = child
+    node.outcome = chess.Outcome(chess.Termination.VARIANT_WIN, not engine_color)
+    start = time.perf_counter()
+    chain.eval(engine_color)
+    print(f"eval of a 100000 deep variation: {time.perf_counter() - start:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# Time the PosLab engine takes to answer a human move, analysing only after the move
+# versus analysing likely replies in advance while the human thinks.
+# The human plays a random one of the engine's best three moves, or a random legal move with probability of surprise.
+#
+# usage: python benchmarks/poslab_replies.py <engine path> [moves] [think time] [time per move] [surprise]
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+from chess.engine import Limit
+
+from chesslab.apps import MainApp
+from chesslab.apps.poslab import PosLab, tree_store, reply_analyser
+from chesslab.engine import engine_pool
+from chesslab.engine.cache import analysis_cache
+
+
+def play(engine_path, replies, moves, think, limit, surprise):
+    rng = random.Random(0)
+    analysis_cache.clear()
+    app = PosLab(MainApp())
+    app.book = False
+    app.engine_path = engine_path
+    app.limit = limit
+    app.replies = replies
+    list(app.execute('restart', ''))
+
+    latencies = []
+    while len(latencies) < moves:
+        if app.outcome() is not None:
+            list(app.execute('restart', ''))
+        time.sleep(think)
+
+        legal = list(app.board.legal_moves)
+        if rng.random() < surprise:
+            move = rng.choice(legal)
+        else:
+            with engine_pool.lease(engine_path) as engine:
+                best = engine.engine.analyse(app.board, Limit(depth=8), multipv=3)
+            move = rng.choice([info['pv'][0] for info in best if 'pv' in info])
+
+        start = time.perf_counter()
+        list(app.execute(app.board.san(move), '', 'term'))
+        latencies.append(time.perf_counter() - start)
+
+    list(app.execute('forget', ''))
+    app.leave()
+    return sorted(latencies)
+
+
+def main():
+    engine_path = sys.argv[1]
+    moves = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    think = float(sys.argv[3]) if len(sys.argv) > 3 else 3.0
+    limit = Limit(time=float(sys.argv[4]) if len(sys.argv) > 4 else 0.5)
+    surprise = float(sys.argv[5]) if len(sys.argv) > 5 else 0.2
+    tree_store.path = os.path.join(tempfile.mkdtemp(), 'benchmark_tree.db')
+
+    for replies in (0, 3):
+        latencies = play(engine_path, replies, moves, think, limit, surprise)
+        print(f"replies {replies}: median {latencies[len(latencies) // 2]:.3f}s, "
+              f"mean {sum(latencies) / len(latencies):.3f}s, max {latencies[-1]:.3f}s")
+    print(reply_analyser.stats())
+
+    reply_analyser.close()
+    engine_pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+# Cost of fetching puzzles from the repository with lazy Puzzle records
+# versus touching the board and SAN of each one as the eager constructor did.
+#
+# usage: python benchmarks/puzzle.py [puzzles db path] [count]
+
+import os
+import sys
+import time
+import pickle
+
+import numpy as np
+
+from chesslab.puzzle_provider import PuzzleRepository
+
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.expanduser('~'), '.chesslab', 'puzzles_db')
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    repository = PuzzleRepository(db_path, 'lichess_puzzle')
+    rowids = repository.index[np.random.default_rng(0).integers(len(repository.index), size=count), PuzzleRepository.ROWID]
+
+    start = time.perf_counter()
+    puzzles = [repository.get(rowid) for rowid in rowids]
+    fetch = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for puzzle in puzzles:
+        puzzle.fen, puzzle.moves_san
+    decode = time.perf_counter() - start
+
+    print(f"fetch {count} lazy puzzles: {fetch:.3f}s")
+    print(f"board and SAN of {count} puzzles: {decode:.3f}s")
+    print(f"lazy fetch is {100 * fetch / (fetch + decode):.0f}% of eager")
+    print(f"pickled puzzle: {len(pickle.dumps(puzzles[0]))} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Cost of saving a PosLab app which has played many variations: the app snapshot,
+# which keeps only the variation being played, and the tree store, which keeps every position.
+#
+# usage: python benchmarks/snapshot.py [positions] [directory]
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+from chesslab.apps import MainApp, snapshot
+from chesslab.apps.poslab import PosLab, TreeStore, Node, tree_store
+
+
+def grow(app, count):
+    rng = random.Random(0)
+    while len(tree_store.nodes) < count:
+        list(app._restart())
+        for ply in range(rng.randint(10, 60)):
+            moves = list(app.board.legal_moves)
+            if not moves:
+                break
+            app.make_move(rng.choice(moves))
+
+
+def timed(f):
+    start = time.perf_counter()
+    res = f()
+    return time.perf_counter() - start, res
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    directory = sys.argv[2] if len(sys.argv) > 2 else tempfile.mkdtemp()
+    snap_path = os.path.join(directory, 'benchmark.snap')
+    tree_store.path = os.path.join(directory, 'benchmark_tree.db')
+
+    app = PosLab(MainApp())
+    app.book = False
+    grow_time, _ = timed(lambda: grow(app, count))
+    flush_time, _ = timed(tree_store.flush)
+
+    def save():
+        snapshot.save(app, snap_path)
+        snapshot.snapshot_writer.flush()
+
+    full_time, _ = timed(save)
+    app.make_move(next(iter(app.board.legal_moves)))
+    capture_time, _ = timed(lambda: snapshot.save(app, snap_path))
+    snapshot.snapshot_writer.flush()
+
+    snapshot.journals.clear()
+    load_time, loaded = timed(lambda: snapshot.load(snap_path))
+    decode_time, _ = timed(lambda: loaded.current_node)
+
+    list(app._restart())
+    store = TreeStore(Node, tree_store.path)
+    root = store.node(app.current_node.key)
+    read_time, children = timed(lambda: len(root.children))
+
+    print(f"{len(tree_store.nodes)} positions played in {grow_time:.3f}s, flushed in {flush_time:.3f}s")
+    print(f"first snapshot: {full_time:.3f}s, after a move: {capture_time:.4f}s, {os.path.getsize(snap_path)} bytes")
+    print(f"snapshot loaded in {load_time:.4f}s, current node decoded on first use in {decode_time:.4f}s")
+    print(f"root with {children} children read from a new store in {read_time:.4f}s, "
+          f"{len(store.nodes)} nodes in its memory")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# Import throughput of GameStore and query latency versus re-reading PGN with Collection.
+#
+# usage: python benchmarks/storage.py [pgn path] [player] [store path]
+
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+from chesslab.collection import Collection
+from chesslab.storage import GameStore
+
+
+def main():
+    pgn_path = sys.argv[1] if len(sys.argv) > 1 else 'data/magnus_first.pgn'
+    player = sys.argv[2] if len(sys.argv) > 2 else 'Magnus Carlsen'
+    path = sys.argv[3] if len(sys.argv) > 3 else tempfile.mkdtemp()
+
+    start = time.perf_counter()
+    store = GameStore.import_pgn(pgn_path, path)
+    elapsed = time.perf_counter() - start
+    print(f"import: {elapsed:.2f} s, {len(store) / elapsed:.0f} games/s, {len(store.moves) / elapsed:.0f} plies/s")
+
+    start = time.perf_counter()
+    collection = Collection(pgn_path)
+    scores = [float(game.headers['WhiteScore']) for game in collection.games
+              if game.headers.get('White') == player and 'WhiteScore' in game.headers]
+    pgn_elapsed = time.perf_counter() - start
+    print(f"Collection: mean WhiteScore of {player} = {np.mean(scores):.2f} in {1000 * pgn_elapsed:.1f} ms")
+
+    start = time.perf_counter()
+    store = GameStore(path)
+    score = np.nanmean(store.column('WhiteScore')[store.equals('White', player)])
+    store_elapsed = time.perf_counter() - start
+    print(f"GameStore: mean WhiteScore of {player} = {score:.2f} in {1000 * store_elapsed:.1f} ms "
+          f"({pgn_elapsed / store_elapsed:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,10 @@ import os
 import shlex
 import datetime
 import subprocess
+import threading
 import inspect
+import traceback
+from collections import OrderedDict
 from inspect import signature
 from pathlib import Path
 
@@ -19,7 +22,10 @@ import cairosvg
 from chess import Board, Move, Color
 from chess.engine import SimpleEngine, Limit, PovScore
 
-from chesslab.engine import ChesslabEngine
+from chesslab.engine import engine_pool
+from chesslab.engine.cache import analysis_cache
+from chesslab.apps.board_renderer import sprite_renderer
+from chesslab.apps import snapshot
 
 # black knight replacement from https://github.com/lichess-org/lila/blob/master/public/piece/merida/bN.svg
 chess.svg.PIECES["n"] = r"""<g id="black-knight" class="black knight" clip-rule="evenodd" fill-rule="evenodd" height="50mm" image-rendering="optimizeQuality" shape-rendering="geometricPrecision" text-rendering="geometricPrecision" viewBox="0 0 50 50" width="50mm" transform="translate(0.5, 0.7) scale(0.84)"><linearGradient id="a" gradientUnits="userSpaceOnUse" x1="21.253" x2="77.641" y1="37.592" y2="37.469"><stop offset="0" stop-color="#fff"/><stop offset="1" stop-color="#fff" stop-opacity="0"/></linearGradient><path d="M26.178 9.395c2.6.17 5.004.838 7.222 2.015 2.21 1.169 4.098 2.676 5.656 4.513 1.092 1.287 2.117 2.845 3.082 4.665a28.684 28.684 0 0 1 2.32 5.774 36.511 36.511 0 0 1 1.253 7.46c.177 2.599.262 5.012.262 7.23v5.402H15.468c-.153 0-.22-.407-.212-1.21.009-.814.06-1.466.16-1.965.06-.398.221-.957.467-1.685.254-.728.66-1.609 1.244-2.65.263-.534.89-1.304 1.88-2.32.999-1.016 2.133-2.201 3.429-3.539.745-.762 1.32-1.719 1.744-2.879.423-1.151.601-2.201.533-3.15a8.37 8.37 0 0 1-2.006 1.22c-3.505 1.253-6.045 3.073-7.612 5.452-.118.153-.49.822-1.117 2.015-.33.627-.618 1.059-.847 1.287-.313.314-.77.491-1.363.525-.923.043-1.643-.398-2.16-1.346-.693.203-1.312.288-1.862.254-.923-.347-1.592-.72-2.006-1.117-.847-.847-1.389-1.685-1.651-2.532a9.43 9.43 0 0 1-.381-2.726c0-1.389.855-3.226 2.582-5.512 2.015-2.625 3.09-4.631 3.217-6.003 0-.593.06-1.261.178-2.007a4.198 4.198 0 0 1 .618-1.49c.22-.33.364-.558.432-.677.076-.127.212-.313.415-.559.144-.203.27-.355.372-.457.093-.11.22-.254.373-.44.178-.212.406-.457.694-.745a18.06 18.06 0 0 1-1.067-7.46c3.285 1.169 6.054 3.015 8.28 5.53.551-1.872 1.626-3.387 3.226-4.539 1.321.923 2.371 2.15 3.15 3.666z" fill="#1f1a17"/><path d="M15.688 17.786l.542-.28c.5-.194.652-.559.474-1.092-.195-.491-.576-.66-1.143-.491-1.947.711-3.294 2.015-4.039 3.92-.118.542.076.914.593 1.118.516.16.864-.017 1.041-.55.136-.28.229-.466.297-.543.186.144.423.246.72.297 1.007.16 1.6-.28 1.76-1.338a1.498 1.498 0 0 0-.245-1.041zM11.573 34.55c.06-.153.17-.373.322-.67.28-.693.415-1.108.415-1.244-.026-.457-.271-.694-.72-.694-.33 0-.711.474-1.16 1.414a.97.97 0 0 1-.296.347c-.449.466-.381.855.194 1.168.534.314.94.212 1.245-.321zm14.63-9.204c1.16-1.524 1.728-3.217 1.71-5.08-.067-.55-.38-.82-.94-.82-.761 0-1.057.279-.897.837.051.915-.033 1.668-.27 2.261-.382.94-.805 1.643-1.262 2.108-.254.5-.102.864.449 1.092.525.246.931.119 1.21-.398zM19.726 13.24a6.798 6.798 0 0 1 .051-1.93c-.99.194-1.922.66-2.802 1.388-.525.28-.652.67-.373 1.169.28.508.67.592 1.169.245.347-.186.669-.355.956-.508.288-.16.618-.28 1-.364zm23.25 31.454c-.017 0 0-.449.042-1.346.131-3.108.096-6.221.076-9.33a26.837 26.837 0 0 0-.889-6.613c-.84-3.31-2.124-6.485-4.072-9.297-2.634-3.845-6.814-6.033-11.286-6.976.126.766.033 1.54.076 2.311a25.82 25.82 0 0 1 4.538 2.032c4.241 2.555 6.414 7.276 7.197 11.93 1.272 6.154.453 11.557.813 17.289zM9.439 30.139c.475-.34.525-.729.144-1.194-.398-.381-.83-.415-1.312-.102-1.007.66-1.55 1.533-1.617 2.608.017.542.347.804.974.77.592-.05.88-.355.863-.922.136-.525.449-.915.948-1.16z" fill="url(#a)"/></g>"""
@@ -33,6 +39,110 @@ def convert_svg_to_png(svg_string):
     return output
 
 
+class PngCache:
+    """
+    LRU of board PNGs keyed by everything drawn on the board.
+    """
+    def __init__(self, max_images=128):
+        self.max_images = max_images
+        self.images = OrderedDict()
+        self.last_render_time = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, render):
+        start = time.perf_counter()
+        if key in self.images:
+            self.images.move_to_end(key)
+            self.hits += 1
+        else:
+            self.images[key] = render()
+            self.misses += 1
+            while len(self.images) > self.max_images:
+                self.images.popitem(last=False)
+        self.last_render_time = time.perf_counter() - start
+        return self.images[key]
+
+    def stats(self):
+        requests = self.hits + self.misses
+        hit_rate = 100 * self.hits / requests if requests else 0
+        return f"render {1000 * self.last_render_time:.1f} ms, png cache hit rate={hit_rate:.1f}% images={len(self.images)}"
+
+
+png_cache = PngCache()
+
+
+class BoardFrame:
+    """
+    Snapshot of everything drawn on the board image, rendered later with render().
+    """
+    def __init__(self, board, size, flipped, coords, colors, debug=False):
+        self.key = (board.board_fen(), size, flipped, coords, tuple(sorted(colors.items())))
+        self.debug = debug
+
+    def render(self):
+        board_fen, size, flipped, coords, colors = self.key
+        return png_cache.get(self.key, lambda: sprite_renderer.render(chess.BaseBoard(board_fen), size=size, flipped=flipped,
+                                                                      coordinates=coords, colors=dict(colors)))
+
+
+class RenderWorker:
+    """
+    Renders board frames on its own thread and puts images to out_queue, so text payloads are not held back by rendering.
+    Only the latest frame is rendered, frames posted while the worker is busy replace each other,
+    and a frame equal to the last one sent is not sent again.
+    With image_ring images are written to shared memory and only their handles are put to out_queue.
+    """
+    def __init__(self, out_queue, image_ring=None):
+        self.out_queue = out_queue
+        self.image_ring = image_ring
+        self.condition = threading.Condition()
+        self.pending = None
+        self.last_key = None
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def post(self, frame):
+        with self.condition:
+            self.pending = frame
+            self.condition.notify()
+
+    def loop(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                frame = self.pending
+                self.pending = None
+
+            if frame.key == self.last_key:
+                continue
+
+            try:
+                img_data = frame.render()
+            except Exception as e:
+                # the logic loop is not told of render errors, report them and go on with the next frame
+                self.out_queue.put(Payload.text(traceback.format_exc() if frame.debug else repr(e)))
+                continue
+            self.last_key = frame.key
+            payload = Payload(png_cache.stats() if frame.debug else None)
+            if self.image_ring is not None:
+                payload.img_handle = self.image_ring.write(img_data)
+            if payload.img_handle is None:
+                payload.img_data = img_data
+            self.out_queue.put(payload)
+
+    def send(self, payload):
+        """
+        Put payload to out_queue at once and its frame to the render worker.
+        """
+        frame, payload.frame = payload.frame, None
+        if frame is None or payload.text is not None or payload.has_image() or payload.last or payload.ecb_data is not None:
+            self.out_queue.put(payload)
+        if frame is not None:
+            self.post(frame)
+
+
 class EcbCommand:
     def __init__(self, cmd, content):
         self.cmd = cmd
@@ -58,19 +168,33 @@ class Payload:
         payload.last = True
         return payload
 
-    def __init__(self, text=None, img_data=None, ecb_data=None):
+    def __init__(self, text=None, img_data=None, ecb_data=None, frame=None):
         self.text = text
         self.img_data = img_data
         self.last = None
         self.ecb_data = ecb_data
+        self.frame = frame
+        self.img_handle = None
 
+    def has_image(self):
+        return self.img_data is not None or self.img_handle is not None
 
-class MainApp:
+    def get_img_data(self, image_ring=None):
+        """
+        Image bytes sent inline or through image_ring, None if the image in the ring was overwritten.
+        """
+        if self.img_handle is not None:
+            return image_ring.read(self.img_handle)
+        return self.img_data
+
+
+class MainApp(snapshot.Restorable):
     cmd = None
     copyright_str = f"Copyright (c) Michal Stanislaw Wojcik 2023."
     program_data_path = os.path.join(os.path.expanduser('~'), '.chesslab')
     snapshot_dir = os.path.join(program_data_path, 'snapshots')
     pkl_file_path = os.path.join(program_data_path, 'chesslab.pkl')
+    state_path = os.path.join(program_data_path, 'chesslab.snap')
     puzzles_db_path = os.path.join(program_data_path, 'puzzles_db')
 
     attrs_to_copy = [
@@ -99,18 +223,19 @@ class MainApp:
         'my',
         'chess960',
         'ecb_enabled',
+        'cache_disk',
         'apps'
     ]
 
     def __getstate__(self):
-        state = self.__dict__
-        if 'pp' in state:
-            del state['pp']
-        return state
+        return {name: value for name, value in self.__dict__.items() if name != 'pp'}
 
     @classmethod
     def app(cls):
-        if os.path.isfile(cls.pkl_file_path):
+        if os.path.isfile(cls.state_path):
+            return snapshot.load(cls.state_path)
+        elif os.path.isfile(cls.pkl_file_path):
+            # saved before snapshots
             with open(cls.pkl_file_path, "rb") as f:
                 return pickle.load(f)
         else:
@@ -118,6 +243,9 @@ class MainApp:
 
     @classmethod
     def load_snapshot(cls, name):
+        path = os.path.join(cls.snapshot_dir, name + '.snap')
+        if os.path.isfile(path):
+            return snapshot.load(path)
         with open(os.path.join(cls.snapshot_dir, name + '.pkl'), "rb") as f:
             return pickle.load(f)
 
@@ -151,6 +279,7 @@ class MainApp:
         self.chess960 = False
         self.engine_color = True
         self.ecb_enabled = True
+        self.cache_disk = False
         self.colors = {
             'square dark': "#858383",
             'square light': "#d9d7d7"
@@ -161,7 +290,7 @@ class MainApp:
         return round(math.pow(10, 1.7 * math.tan(math.pi * (r - 2250) / 4500) + 3.7))
 
     def copy_attrs(self, target):
-        for attr_name in MainApp.attrs_to_copy:
+        for attr_name in self.attrs_to_copy:
             if hasattr(self, attr_name) and hasattr(target, attr_name):
                 setattr(target, attr_name, getattr(self, attr_name))
 
@@ -184,15 +313,14 @@ shows stored FEN not FEN of current position to get current FEN type: current fe
         if not os.path.isdir(self.program_data_path):
             os.mkdir(self.program_data_path)
 
-        with open(self.pkl_file_path, "wb") as f:
-            pickle.dump(self, f)
+        snapshot.save(self, self.state_path)
+        snapshot.snapshot_writer.flush()
 
     def save_snapshot(self, name):
         if not os.path.isdir(self.snapshot_dir):
             os.mkdir(self.snapshot_dir)
 
-        with open(os.path.join(self.snapshot_dir, name + '.pkl'), "wb") as f:
-            pickle.dump(self, f)
+        snapshot.save(self, os.path.join(self.snapshot_dir, name + '.snap'))
 
     def _app(self):
         yield self.start()
@@ -211,14 +339,13 @@ e.g. save snapshot1"""
         """
 List all snapshots which you can load using load command.
         """
-        for path in glob.glob(os.path.join(self.snapshot_dir, "*.pkl")):
-            yield Payload.text(Path(path).name[:-4])
+        names = {Path(path).stem for ext in ('snap', 'pkl') for path in glob.glob(os.path.join(self.snapshot_dir, f"*.{ext}"))}
+        for name in sorted(names):
+            yield Payload.text(name)
 
     def load(self):
-        if os.path.isfile(self.pkl_file_path):
-            with open(self.pkl_file_path, "rb") as f:
-                obj = pickle.load(f)
-                self.__dict__ = obj.__dict__
+        if os.path.isfile(self.state_path) or os.path.isfile(self.pkl_file_path):
+            self.__dict__ = MainApp.app().__dict__
 
     def _load(self, value: str):
         """
@@ -236,16 +363,24 @@ e.g. load snapshot1"""
     def exit(self):
         return MainApp.create_from(self)
 
+    def leave(self):
+        """
+        Called before another application replaces this one.
+        """
+        pass
+
+    def board_frame(self):
+        return BoardFrame(self.board, self.size, self.flipped, self.coords, self.colors, self.debug)
+
     def board_png_data(self):
-        return convert_svg_to_png(chess.svg.board(self.board,
-                                                  size=self.size,
-                                                  flipped=self.flipped,
-                                                  coordinates=self.coords,
-                                                  colors=self.colors)).getvalue()
+        return self.board_frame().render()
 
     def payload(self, text=None):
+        """
+        text with a frame of the current board, frames are rendered by RenderWorker.
+        """
         if self.refresh:
-            return Payload(text, self.board_png_data())
+            return Payload(text, frame=self.board_frame())
         else:
             return Payload.text(text)
 
@@ -538,7 +673,7 @@ analyse nodes 3.1m"""
         if self.engine_path is None:
             yield self.payload("no engine")
             return
-        with ChesslabEngine(self.engine_path) as engine:
+        with engine_pool.lease(self.engine_path) as engine:
             limit = self.parse_limit(arg_name, value)
             lines = engine.analyse(self.board, limit, self.lines)
             text = f'analysis [{limit}] <<\n'
@@ -558,7 +693,7 @@ e.g. score 5"""
         if self.engine_path is None:
             yield self.payload("no engine")
             return
-        with ChesslabEngine(self.engine_path) as engine:
+        with engine_pool.lease(self.engine_path) as engine:
             lines = engine.analyse(self.board, Limit(int(t)), self.lines)
             text = f'analysis [{t} sec] <<\n'
             for i, line in enumerate(lines):
@@ -566,6 +701,29 @@ e.g. score 5"""
                 yield Payload.text(text)
                 break
 
+    def _cache(self, *args):
+        """
+Manage analysis cache shared by all applications.
+
+Show cache hits and misses:
+cache
+
+Remove all cached analysis:
+cache clear
+
+Keep (or not) analysis on disk between sessions:
+cache disk on|off
+"""
+        if args:
+            cmd = args[0]
+            if cmd == 'clear':
+                analysis_cache.clear()
+            if cmd == 'disk' and len(args) > 1:
+                self.cache_disk = (args[1] == 'on')
+                analysis_cache.use_disk(self.cache_disk)
+
+        yield Payload.text(analysis_cache.stats())
+
     def _pgn(self):
         """
 Print sequence of moves in console."""
@@ -0,0 +1,102 @@
+import io
+import zlib
+import struct
+from collections import OrderedDict
+
+import numpy as np
+import chess
+import chess.svg
+import cairosvg
+from PIL import Image
+
+
+def rasterize(svg_string, mode='RGBA'):
+    return Image.open(io.BytesIO(cairosvg.svg2png(bytestring=svg_string))).convert(mode)
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def encode_png(image, compress_level=1):
+    """
+    RGB image as PNG without row filters, which is several times faster than PIL adaptive filtering
+    and about as small for flat board images.
+    """
+    width, height = image.size
+    raw = np.zeros((height, 3 * width + 1), dtype=np.uint8)
+    raw[:, 1:] = np.asarray(image).reshape(height, -1)
+    return (b'\x89PNG\r\n\x1a\n' +
+            png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            png_chunk(b'IDAT', zlib.compress(raw.tobytes(), compress_level)) +
+            png_chunk(b'IEND', b''))
+
+
+class SpriteRenderer:
+    """
+    Draws board PNGs the way chess.svg.board does without rasterizing SVG for every frame.
+    The empty board (squares, margin and coordinates) is rasterized once per (size, flipped, coordinates, colors)
+    and each piece once per square it is drawn on, a frame is the empty board with piece sprites pasted on it.
+    """
+    def __init__(self, max_layouts=8, compress_level=1):
+        self.max_layouts = max_layouts
+        self.compress_level = compress_level
+        self.backgrounds = OrderedDict()
+        self.sprites = OrderedDict()
+
+    @staticmethod
+    def layout(size, coordinates):
+        """
+        Scale of SVG units to pixels and offset of the a8 square in SVG units.
+        """
+        margin = 15 if coordinates else 0
+        full_size = 2 * margin + 8 * chess.svg.SQUARE_SIZE
+        return size / full_size, margin
+
+    def cached(self, cache, key, create):
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            cache[key] = create()
+            while len(cache) > self.max_layouts:
+                cache.popitem(last=False)
+        return cache[key]
+
+    def background(self, size, flipped, coordinates, colors):
+        key = (size, flipped, coordinates, tuple(sorted(colors.items())))
+        return self.cached(self.backgrounds, key,
+                           lambda: rasterize(chess.svg.board(None, size=size, flipped=flipped,
+                                                             coordinates=coordinates, colors=colors), 'RGB'))
+
+    def sprite(self, sprites, symbol, x, y, scale):
+        """
+        Piece rasterized at its exact subpixel position on the board,
+        the sprite is pasted at whole pixels (int(x * scale), int(y * scale)).
+        """
+        left, top = int(x * scale), int(y * scale)
+        key = (symbol, left, top)
+        if key not in sprites:
+            side = int(chess.svg.SQUARE_SIZE * scale) + 2
+            view_box = f"{left / scale - x} {top / scale - y} {side / scale} {side / scale}"
+            svg = (f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+                   f'width="{side}" height="{side}" viewBox="{view_box}">{chess.svg.PIECES[symbol]}</svg>')
+            sprites[key] = rasterize(svg)
+        return sprites[key], (left, top)
+
+    def render(self, board, size, flipped=False, coordinates=True, colors=None):
+        colors = colors or {}
+        scale, offset = self.layout(size, coordinates)
+        image = self.background(size, flipped, coordinates, colors).copy()
+        sprites = self.cached(self.sprites, (size, coordinates), dict)
+        for square, piece in board.piece_map().items():
+            file_index = chess.square_file(square)
+            rank_index = chess.square_rank(square)
+            x = (7 - file_index if flipped else file_index) * chess.svg.SQUARE_SIZE + offset
+            y = (rank_index if flipped else 7 - rank_index) * chess.svg.SQUARE_SIZE + offset
+            sprite, position = self.sprite(sprites, piece.symbol(), x, y, scale)
+            image.paste(sprite, position, sprite)
+
+        return encode_png(image, self.compress_level)
+
+
+sprite_renderer = SpriteRenderer()
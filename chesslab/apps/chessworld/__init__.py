@@ -5,8 +5,9 @@ from datetime import datetime
 
 import chess
 import chess.pgn
-from chesslab.engine import ChesslabEngine, Limit
+from chesslab.engine import Limit
 from chesslab.apps import MainApp, Payload
+from chesslab.apps.chessworld.ponder import ponderer
 from chesslab.game_score import score_to_numeric
 
 
@@ -17,6 +18,8 @@ ChessWorld
 an application to simulate games, tournaments and players with specific ratings
     """
     cmd = "chessworld"
+    # analyse the position after the predicted reply while the human thinks
+    ponder = True
 
     def __init__(self, main_app=None):
         MainApp.__init__(self)
@@ -46,6 +49,7 @@ an application to simulate games, tournaments and players with specific ratings
         self.resigned = False
         self.board = chess.Board()
         self.fen = self.board.fen()
+        self.game_id = datetime.now().isoformat()
         self.limit = Limit(nodes=self.rating2nodes(self.rating))
         self.can_exist = False
 
@@ -81,17 +85,25 @@ an application to simulate games, tournaments and players with specific ratings
         return line
 
     def choose_engine_move(self):
-        with ChesslabEngine(self.engine_path) as engine:
-            lines = engine.analyse(self.board, self.limit, self.lines)
-            line = self.choose_line(lines)
+        lines = ponderer.analyse(self.engine_path, self.game_id, self.board, self.limit, self.lines)
+        line = self.choose_line(lines)
+        if self.ponder and len(line.moves) > 1:
+            # the human reply predicted by the line
+            ponderer.ponder(self.engine_path, self.game_id, self.board, line.moves[0], line.moves[1],
+                            self.limit, self.lines)
         return line.moves[0]
 
     def choose_automatic_move(self):
         move = self.book_move()
         if move is not None:
+            ponderer.stop()
             return move
         return self.choose_engine_move()
 
+    def leave(self):
+        ponderer.stop()
+        super().leave()
+
     def make_move(self, move, send=False):
         if send:
             yield from self.send_move_to_bt(move.uci())
@@ -143,6 +155,7 @@ my white|black|random|alter
     def _resign(self):
         if not self.resigned:
             self.resigned = True
+            ponderer.stop()
             outcome = self.fixed_outcome()
             self.update_my_rating(outcome)
             yield from self.game_info()
@@ -202,6 +215,8 @@ Start new serious game """
 
         yield from MainApp._new(self)
 
+        ponderer.new_game()
+        self.game_id = datetime.now().isoformat()
         self.my_rating_old = self.my_rating
         self.resigned = False
         self.choose_engine_color()
@@ -243,6 +258,20 @@ Display game outcome
         else:
             yield from self.game_info()
 
+    def _ponder(self, value: str = None):
+        """
+Let the engine think while you think about the move it expects from you,
+so it answers at once when you play it.
+Without argument shows how often you played the expected move in this game.
+
+ponder on|off"""
+        if value is None:
+            yield Payload.text(ponderer.stats())
+        else:
+            self.ponder = value == 'on'
+            if not self.ponder:
+                ponderer.stop()
+
     def _back(self):
         yield self.payload("Can't take back during serious game.")
 
@@ -254,6 +283,7 @@ Display game outcome
                 yield self.payload()
                 outcome = self.fixed_outcome()
                 if outcome is not None:
+                    ponderer.stop()
                     self.update_my_rating(outcome)
                     yield from self.game_info()
                 else:
@@ -263,6 +293,7 @@ Display game outcome
                     yield Payload.text(san_str)
                     outcome = self.fixed_outcome()
                     if outcome is not None:
+                        ponderer.stop()
                         self.update_my_rating(outcome)
                         yield from self.game_info()
                     else:
@@ -0,0 +1,117 @@
+import threading
+
+from chess.engine import EngineError
+
+from chesslab.engine import Line, engine_pool
+from chesslab.engine.cache import analysis_cache, engine_key
+
+
+class Ponderer:
+    """
+    Engine kept for the game being played, which analyses the position after the reply of the human
+    predicted from the engine's line while the human thinks. When the human plays the predicted reply,
+    the analysis goes on and its lines are the engine's answer, with a nodes limit mostly searched already.
+    Another reply stops it. Pondering is the multipv analysis the engine would start after the reply
+    rather than go ponder of a UCI play command, which gives a single line, since the engine chooses among lines.
+    """
+    def __init__(self):
+        self.engine = None
+        self.lock = threading.RLock()
+        # board after the predicted reply, what it is analysed with and the analysis result
+        self.pondering = None
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, path, game):
+        if self.engine is not None and (self.engine.path != path or not self.engine.is_alive()):
+            engine_pool.release(self.engine)
+            self.engine = None
+        if self.engine is None:
+            self.engine = engine_pool.acquire(path)
+        self.engine.game = game
+        return self.engine
+
+    def analyse(self, path, game, board, limit, multipv):
+        """
+        Lines of the board position from pondering if the human played the predicted reply,
+        from a new analysis if not.
+        """
+        with self.lock:
+            pondering, self.pondering = self.pondering, None
+            try:
+                if pondering is not None:
+                    ponder_board, key, result = pondering
+                    # pondering for another game or limit predicted nothing about this move
+                    if key == (path, game, limit, multipv):
+                        if ponder_board.fen() == board.fen():
+                            self.hits += 1
+                            result.wait()
+                            infos = result.multipv
+                            analysis_cache.put(self.engine.cache_key, board, limit, multipv, infos)
+                            return [Line(info) for info in infos]
+                        self.misses += 1
+                    result.stop()
+
+                return self.acquire(path, game).analyse(board, limit, multipv)
+            except EngineError:
+                self.discard()
+                raise
+
+    def ponder(self, path, game, board, move, reply, limit, multipv):
+        """
+        Analyse the board position after move and the predicted reply.
+        """
+        ponder_board = board.copy()
+        ponder_board.push(move)
+        if ponder_board.is_game_over(claim_draw=True):
+            self.stop()
+            return
+        ponder_board.push(reply)
+        if ponder_board.is_game_over(claim_draw=True) or analysis_cache.get(engine_key(path), ponder_board, limit, multipv) is not None:
+            return
+
+        with self.lock:
+            self.stop()
+            try:
+                result = self.acquire(path, game).analysis(ponder_board, limit, multipv)
+            except EngineError:
+                self.discard()
+                raise
+            self.pondering = (ponder_board, (path, game, limit, multipv), result)
+
+    def stop(self):
+        with self.lock:
+            if self.pondering is not None:
+                _, _, result = self.pondering
+                self.pondering = None
+                result.stop()
+
+    def new_game(self):
+        """
+        Stop pondering and count the predictions of the new game only.
+        """
+        with self.lock:
+            self.stop()
+            self.hits = 0
+            self.misses = 0
+
+    def discard(self):
+        self.pondering = None
+        if self.engine is not None:
+            engine_pool.discard(self.engine)
+            self.engine = None
+
+    def close(self):
+        with self.lock:
+            self.stop()
+            if self.engine is not None:
+                engine_pool.release(self.engine)
+                self.engine = None
+
+    def stats(self):
+        predicted = self.hits + self.misses
+        rate = 100 * self.hits / predicted if predicted else 0
+        return f"ponderhits={self.hits} misses={self.misses} ponderhit rate={rate:.1f}%"
+
+
+ponderer = Ponderer()
@@ -2,8 +2,10 @@ import os
 import random
 
 import chess
-from chesslab.engine import ChesslabEngine
+from chesslab.engine import engine_pool
 from chesslab.apps import MainApp, Payload
+from chesslab.apps.poslab.tree_store import TreeStore
+from chesslab.apps.poslab.reply_analyser import ReplyJob, reply_analyser
 
 from chess import Move, Outcome, Termination
 from chess.engine import Limit, Cp, Mate, Score, PovScore
@@ -11,10 +13,23 @@ import chess.polyglot
 from chess import Board
 
 
+# outcomes which depend on the moves played to a position rather than on the position
+HISTORY_TERMINATIONS = {Termination.THREEFOLD_REPETITION, Termination.FIVEFOLD_REPETITION,
+                        Termination.FIFTY_MOVES, Termination.SEVENTYFIVE_MOVES}
+
+
 class Node:
+    """
+    Position in PosLab's graph of played variations kept in tree_store, children are keyed by UCI move.
+    parent is the node the position was last reached from, so it follows the variation being played.
+    """
     MATE_SCORE_VALUE = 0xffffffff
+    # fields eval_score depends on, parents are the nodes in memory the node is a child of
+    eval_fields = ('lines', 'human_success', 'outcome')
 
     def __init__(self, turn):
+        self.key = None
+        self.store = None
         self.children = {}
         self.lines = []
         self.turn = turn
@@ -25,6 +40,44 @@ class Node:
         self.bookmark = False
         self.fen = None
 
+    def __setattr__(self, name, value):
+        if self.__dict__.get(name, Node) is value:
+            return
+        self.__dict__[name] = value
+        if name in TreeStore.fields and self.__dict__.get('store') is not None:
+            self.store.changed(self)
+        if name in Node.eval_fields:
+            self.invalidate()
+
+    def __getattr__(self, name):
+        # only for attributes not set: fields of a node not read from the tree store yet
+        if name.startswith('__') or not self.__dict__.pop('unread', False):
+            raise AttributeError(name)
+        self.store.read_node(self)
+        return getattr(self, name)
+
+    def __reduce_ex__(self, protocol):
+        if self.__dict__.get('store') is None:
+            # tree from before the tree store, it is moved to the store when its app starts
+            return object.__reduce_ex__(self, protocol)
+
+        # the node is kept in the store, a pickle keeps the keys of the variation from the root
+        path = []
+        node = self
+        while node is not None:
+            path.append(node.key)
+            node = node.parent
+        return variation_node, (path[::-1],)
+
+    def add_child(self, key, node):
+        self.children[key] = node
+        node.__dict__.setdefault('parents', []).append(self)
+        if node.human_success:
+            # a position reached before by transposition
+            self.invalidate()
+        if self.store is not None:
+            self.store.changed(self)
+
     def get_score_from_lines_copy(self):
         index = 0
         for line in self.lines:
@@ -64,35 +117,46 @@ class Node:
         return score, move
 
     def eval(self, engine_color):
-        if self.eval_score is not None:
-            return self.eval_score
+        """
+        Score of the node for the engine, the best of its lines and human success children on engine move,
+        the worst of human success children on human move. Scores are kept in eval_score until
+        a change below the node clears them, nodes without a score are evaluated children first.
+        """
+        stack = [self]
+        while stack:
+            node = stack[-1]
+            if node.eval_score is not None:
+                stack.pop()
+                continue
 
+            if node.outcome is None:
+                pending = [child for child in node.children.values() if child.human_success and child.eval_score is None]
+                if pending:
+                    stack.extend(pending)
+                    continue
+
+            node.eval_score = node.eval_from_children(engine_color)
+            stack.pop()
+
+        return self.eval_score
+
+    def eval_from_children(self, engine_color):
         if self.outcome is not None:
             if self.outcome.winner is None:
-                self.eval_score = 0
+                return 0
             elif self.outcome.winner == engine_color:
-                self.eval_score = Node.MATE_SCORE_VALUE
-            elif self.outcome.winner == (not engine_color):
-                self.eval_score = - 2 * Node.MATE_SCORE_VALUE
-
-            return self.eval_score
+                return Node.MATE_SCORE_VALUE
+            else:
+                return - 2 * Node.MATE_SCORE_VALUE
 
+        children_scores = [child.eval_score for child in self.children.values() if child.human_success]
         if self.turn == engine_color:
             assert(len(self.lines) > 0)
-            children_scores = [self.children[key].eval(engine_color) for key in self.children if self.children[key].human_success]
-            if children_scores:
-                max_children_score = max(children_scores)
-                score, _ = self.get_score_from_lines()
-                self.eval_score = max(score, max_children_score)
-            else:
-                self.eval_score, _ = self.get_score_from_lines()
-
+            score, _ = self.get_score_from_lines()
+            return max([score] + children_scores)
         else:
             assert (len(self.children) > 0)
-            children_scores = [self.children[key].eval(engine_color) for key in self.children if self.children[key].human_success]
-            self.eval_score = min(children_scores)
-
-        return self.eval_score
+            return min(children_scores)
 
     # Simple version
     # def choose_move(self):
@@ -120,11 +184,33 @@ class Node:
         assert False
 
     def clear_evals(self):
-        self.eval_score = None
-        for key in self.children:
-            child = self.children[key]
-            if child.human_success:
-                child.clear_evals()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            node.eval_score = None
+            stack.extend(child for child in node.children.values() if child.human_success and child.eval_score is not None)
+
+    def invalidate(self):
+        """
+        Clear scores of the node and of its ancestors in memory, which depend on it.
+        An ancestor without a score has none above it depending on the node either.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            node.__dict__['eval_score'] = None
+            stack.extend(parent for parent in node.__dict__.get('parents', ()) if parent.eval_score is not None)
+
+
+tree_store = TreeStore(Node)
+
+
+def variation_node(path):
+    node = None
+    for key in path:
+        parent, node = node, tree_store.node(key)
+        node.parent = parent
+    return node
 
 
 class PosLab(MainApp):
@@ -139,11 +225,23 @@ When you play again, it deviates from the previous variations
 to test your play.
 Human player always has first move regardless of color.
 
-read about following commands: again, decide, bookmark, go
+Variations are remembered for each position, also when it is
+reached by transposition, after restart and in later sessions.
+While you think the engine analyses your likely replies,
+so it often answers at once.
+
+read about following commands: again, decide, bookmark, go, forget, replies
 
 all commands available:"""
 
     cmd = "poslab"
+    # how many best replies of the human are analysed in advance besides the replies played before
+    replies = 3
+    # a draw by repetition or the fifty moves rule ending the variation being played,
+    # it is not kept in the node which is shared by all variations reaching its position
+    variation_outcome = None
+    # where variations are remembered, None keeps them in memory with the app only
+    tree_store = tree_store
 
     def __init__(self, main_app=None):
         MainApp.__init__(self)
@@ -162,17 +260,91 @@ all commands available:"""
         self.book = True
 
     def start(self):
+        if self.tree_store is not None and self.current_node.__dict__.get('store') is None:
+            self.import_tree()
         yield self.payload(f"PosLab\n{MainApp.copyright_str}")
 
+    def execute(self, cmd, value, mode=None):
+        try:
+            yield from MainApp.execute(self, cmd, value, mode)
+        finally:
+            if self.tree_store is not None:
+                self.tree_store.flush()
+            self.analyse_replies()
+
+    def leave(self):
+        reply_analyser.post(None)
+        super().leave()
+
+    def outcome(self):
+        if self.current_node.outcome is not None:
+            return self.current_node.outcome
+        return self.variation_outcome
+
+    def analyse_replies(self):
+        node = self.current_node
+        if (self.replies <= 0 or self.engine_path is None or self.board.turn == self.engine_color
+                or self.outcome() is not None):
+            reply_analyser.post(None)
+            return
+
+        known = [Move.from_uci(key) for key, child in node.children.items() if not child.lines]
+        analysed = [Move.from_uci(key) for key, child in node.children.items() if child.lines]
+        reply_analyser.post(ReplyJob(self.board.copy(), known, analysed, self.replies,
+                                     self.engine_path, self.limit, self.lines, self.fen))
+
+    def get_node(self, board):
+        if self.tree_store is None:
+            return Node(board.turn)
+        return self.tree_store.get(board, self.engine_color)
+
     def initialise(self, engine_color=None):
         if engine_color is None:
             self.engine_color = (not self.board.turn)
         else:
             self.engine_color = engine_color
-        self.current_node = Node(self.board.turn)
+        self.current_node = self.get_node(self.board)
+        self.current_node.parent = None
         self.current_node.fen = self.board.fen()
         self.board_node = self.current_node
         self.human_moved = False
+        self.variation_outcome = None
+
+    def import_tree(self):
+        """
+        Move the tree of an app saved before the tree store to the store.
+        """
+        root = self.current_node
+        while root.parent is not None:
+            root = root.parent
+
+        nodes = {}
+        stack = [root]
+        while stack:
+            old = stack.pop()
+            if id(old) not in nodes:
+                node = self.tree_store.get(Board(old.fen, chess960=self.chess960), self.engine_color)
+                for name in TreeStore.fields:
+                    setattr(node, name, getattr(old, name))
+                if old.outcome is not None and old.outcome.termination in HISTORY_TERMINATIONS:
+                    node.outcome = None
+                nodes[id(old)] = node
+                stack.extend(old.children.values())
+
+        stack = [root]
+        while stack:
+            old = stack.pop()
+            for key, child in old.children.items():
+                nodes[id(old)].add_child(key, nodes[id(child)])
+                stack.append(child)
+
+        for old in (self.board_node, self.current_node):
+            while old is not None:
+                nodes[id(old)].parent = nodes[id(old.parent)] if old.parent is not None else None
+                old = old.parent
+        self.current_node = nodes[id(self.current_node)]
+        self.board_node = nodes[id(self.board_node)]
+        self.tree_store.flush()
 
     def make_move(self, move):
         self.board.push(move)
@@ -180,12 +352,19 @@ all commands available:"""
         if key in self.current_node.children:
             node = self.current_node.children[key]
         else:
-            node = Node(self.board.turn)
-            node.parent = self.current_node
-            if node.outcome is None:
-                node.outcome = self.fixed_outcome()
-            self.current_node.children[key] = node
+            node = self.get_node(self.board)
+            self.current_node.add_child(key, node)
 
+        outcome = self.fixed_outcome()
+        if outcome is not None and outcome.termination in HISTORY_TERMINATIONS:
+            self.variation_outcome = outcome
+        else:
+            self.variation_outcome = None
+            if node.fen is None:
+                # position not reached before
+                node.outcome = outcome
+
+        node.parent = self.current_node
         self.current_node = node
         self.current_node.fen = self.board.fen()
         self.board_node = self.current_node
@@ -196,7 +375,7 @@ all commands available:"""
 
     def go(self, move):
         text = None
-        if self.current_node.outcome is None:
+        if self.outcome() is None:
             if move is not None:
                 if self.engine_color == self.board.turn:
                     yield Payload.text('Engine is on move now.\nType go for engine to move')
@@ -210,7 +389,7 @@ all commands available:"""
                     yield Payload.text('waiting for your move')
                     return
 
-            if self.current_node.outcome is None:
+            if self.outcome() is None:
                 book_move = self.book_move()
 
                 if book_move is not None:
@@ -225,12 +404,12 @@ all commands available:"""
                 yield Payload.text(san_str)
                 yield from self.send_pos_status()
             else:
-                yield Payload.text(self.current_node.outcome.result())
+                yield Payload.text(self.outcome().result())
                 yield from self.bookmark_info_string()
                 return
         else:
             yield from self.send_pos_status()
-            yield self.payload(self.current_node.outcome.result())
+            yield self.payload(self.outcome().result())
             yield from self.bookmark_info_string()
             return
 
@@ -245,7 +424,9 @@ all commands available:"""
             raise Exception("not engine move")
 
         if len(self.current_node.lines) == 0:
-            with ChesslabEngine(self.engine_path) as engine:
+            self.current_node.lines = reply_analyser.take(self.board)
+        if len(self.current_node.lines) == 0:
+            with engine_pool.lease(self.engine_path, game=self.fen) as engine:
                 self.current_node.lines = engine.analyse(self.board, self.limit, self.lines)
 
         move = self.current_node.choose_move(self.engine_color)
@@ -253,6 +434,7 @@ all commands available:"""
         return move
 
     def rewind_and_back_propagate_outcome(self):
+        # a variation outcome is not a success in the position, which can be reached without repeating moves
         if self.current_node.outcome is not None:
         # determine if this is human success
             if self.current_node.outcome.winner is None:
@@ -271,8 +453,7 @@ all commands available:"""
             if human_success:
                 self.current_node.human_success = True
 
-        self.current_node.eval_score = 0
-        self.current_node.clear_evals()
+        # scores which depend on changed nodes were cleared as they changed
         if bookmarked_node is not None:
             self.current_node = bookmarked_node
             # self.current_node.bookmark = False
@@ -287,7 +468,7 @@ all commands available:"""
         """
 Play the position again against the engine.
 Your previous variations are remembered and used to choose different variations to play."""
-        if self.human_moved and self.current_node.outcome is None:
+        if self.human_moved and self.outcome() is None:
             yield Payload.text("Can't start again with unknown outcome")
             return
         self.rewind_and_back_propagate_outcome()
@@ -295,6 +476,7 @@ Your previous variations are remembered and used to choose different variations
             self.board_node = self.board_node.parent
             self.board.pop()
         self.human_moved = False
+        self.variation_outcome = None
         yield self.payload()
 
     def _fen(self, value: str = None):
@@ -312,7 +494,8 @@ e.g. fen rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"""
 
     def _restart(self, engine_color: str = None):
         """
-Delete all memory from played variations and start again
+Start again from the position, played variations are still remembered.
+To delete them type forget.
 
 restart - you plays first
 restart white - engine plays as white
@@ -324,6 +507,37 @@ restart black - engine plays as black
         else:
             self.initialise(engine_color == 'white')
 
+    def _forget(self):
+        """
+Delete all memory from played variations from the starting position and start again."""
+        root = self.current_node
+        while root.parent is not None:
+            root = root.parent
+        yield from MainApp._fen(self, self.fen)
+        if self.tree_store is not None:
+            self.initialise(self.engine_color)
+            count = self.tree_store.forget(self.current_node)
+        else:
+            # the tree in memory is dropped with its root
+            seen = set()
+            stack = [root]
+            while stack:
+                node = stack.pop()
+                if id(node) not in seen:
+                    seen.add(id(node))
+                    stack.extend(node.children.values())
+            count = len(seen)
+        self.initialise(self.engine_color)
+        yield Payload.text(f"{count} positions forgotten")
+
+    def _tree(self):
+        """
+Show how many positions are remembered and how many of them are loaded."""
+        if self.tree_store is None:
+            yield Payload.text("positions are remembered with the app only")
+        else:
+            yield Payload.text(self.tree_store.stats())
+
     def _onmove(self):
         """
 Print who is on move """
@@ -381,6 +595,20 @@ e.g.
 rating 1300"""
         self.limit = Limit(nodes=self.rating2nodes(value))
 
+    def _replies(self, value: int = None):
+        """
+Set how many of your best replies the engine analyses while you think,
+besides the replies you played before. 0 turns the analysis off.
+Without argument shows how often your reply was analysed in advance.
+
+replies <arg: int>
+
+e.g. replies 3"""
+        if value is None:
+            yield Payload.text(reply_analyser.stats())
+        elif value >= 0:
+            self.replies = value
+
     def _back(self):
         yield self.payload("Can't take back during serious game.")
 
@@ -400,7 +628,7 @@ decide white-wins|black-wins|draw
         #         parent.outcome = Outcome(winner=None, termination=Termination.VARIANT_DRAW)
         #     self.current_node.outcome = parent.outcome
 
-        if self.current_node.outcome is None:
+        if self.outcome() is None:
             node = self.current_node
             if value == "white-wins":
                 node.outcome = Outcome(winner=chess.WHITE, termination=Termination.VARIANT_WIN)
@@ -0,0 +1,172 @@
+import threading
+import traceback
+
+import chess.polyglot
+
+from chesslab.engine import Line, engine_pool
+from chesslab.engine.cache import analysis_cache
+
+
+class ReplyJob:
+    """
+    Position with the human on move and what to analyse after the human replies.
+    known are replies played before whose positions have no lines yet,
+    width is how many of the best replies of a multipv analysis are analysed too.
+    """
+    def __init__(self, board, known, analysed, width, engine_path, limit, lines, game):
+        self.board = board
+        self.known = known
+        self.analysed = analysed
+        self.width = width
+        self.engine_path = engine_path
+        self.limit = limit
+        self.lines = lines
+        self.game = game
+
+    def key(self):
+        return (self.board.fen(), tuple(self.known), self.width, self.engine_path, self.limit, self.lines, self.game)
+
+
+class ReplyAnalyser:
+    """
+    Analyses positions after likely replies of the human on its own thread while the human thinks,
+    so that the engine answers a predicted reply without analysing. Replies played before are analysed first,
+    then the best ones of a multipv analysis. Only the latest job is worked on, a new job stops the analysis
+    of the previous one and drops its results, taking the lines of the reply played stops the job
+    so the engine has the processor for the reply if it was not predicted.
+    Complete analyses are put to the analysis cache too.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.job = None
+        self.job_key = None
+        self.generation = 0
+        # zobrist hash of the position being analysed and its analysis result
+        self.running = None
+        self.busy = False
+        self.ready = {}
+        self.thread = None
+        self.hits = 0
+        self.waits = 0
+        self.misses = 0
+
+    def post(self, job):
+        """
+        Start analysing replies in the job position, None stops.
+        Posting the job being worked on again does not restart it.
+        """
+        key = job.key() if job is not None else None
+        with self.condition:
+            if key == self.job_key:
+                return
+            self.cancel()
+            self.job = job
+            self.job_key = key
+            if job is not None and self.thread is None:
+                self.thread = threading.Thread(target=self.loop, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def cancel(self):
+        with self.condition:
+            self.generation += 1
+            self.job = None
+            self.job_key = None
+            self.ready.clear()
+            if self.running is not None:
+                self.running[1].stop()
+
+    def take(self, board):
+        """
+        Lines of the board position if it was analysed in advance, empty if not.
+        A position being analysed is waited for.
+        """
+        key = chess.polyglot.zobrist_hash(board)
+        with self.condition:
+            waited = key not in self.ready and self.running is not None and self.running[0] == key
+            if waited:
+                self.condition.wait_for(lambda: self.running is None or self.running[0] != key)
+            lines = self.ready.pop(key, [])
+            if lines and waited:
+                self.waits += 1
+            elif lines:
+                self.hits += 1
+            elif self.job_key is not None:
+                self.misses += 1
+            self.cancel()
+            return lines
+
+    def loop(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.job is not None)
+                job, generation = self.job, self.generation
+                self.job = None
+                self.busy = True
+            try:
+                with engine_pool.lease(job.engine_path, game=job.game) as engine:
+                    self.analyse_replies(engine, job, generation)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def analyse_replies(self, engine, job, generation):
+        replies = list(job.known)
+        if job.width > 0:
+            lines = self.analyse(engine, job.board, job.limit, job.width, generation)
+            if lines is None:
+                return
+            replies += [line.moves[0] for line in lines
+                        if line.moves and line.moves[0] not in replies and line.moves[0] not in job.analysed]
+
+        for move in replies:
+            board = job.board.copy()
+            board.push(move)
+            if board.is_game_over(claim_draw=True):
+                continue
+            if self.analyse(engine, board, job.limit, job.lines, generation, keep=True) is None:
+                return
+
+    def analyse(self, engine, board, limit, multipv, generation, keep=False):
+        """
+        Lines of the board position, None if the job was stopped.
+        """
+        key = chess.polyglot.zobrist_hash(board)
+        infos = analysis_cache.get(engine.cache_key, board, limit, multipv)
+        analysed = infos is None
+        if analysed:
+            with engine.analysis(board, limit, multipv) as result:
+                with self.condition:
+                    self.running = (key, result)
+                    if generation != self.generation:
+                        result.stop()
+                result.wait()
+                infos = result.multipv
+
+        with self.condition:
+            self.running = None
+            self.condition.notify_all()
+            if generation != self.generation:
+                return None
+            if analysed:
+                analysis_cache.put(engine.cache_key, board, limit, multipv, infos)
+            lines = [Line(info) for info in infos]
+            if keep:
+                self.ready[key] = lines
+            return lines
+
+    def close(self):
+        with self.condition:
+            self.cancel()
+            self.condition.wait_for(lambda: not self.busy, timeout=5)
+
+    def stats(self):
+        predicted = self.hits + self.waits + self.misses
+        rate = 100 * (self.hits + self.waits) / predicted if predicted else 0
+        return f"replies analysed in advance={self.hits} being analysed={self.waits} not predicted={self.misses} hit rate={rate:.1f}%"
+
+
+reply_analyser = ReplyAnalyser()
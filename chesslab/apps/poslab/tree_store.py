@@ -0,0 +1,160 @@
+import os
+import json
+import pickle
+import sqlite3
+import threading
+import weakref
+
+import chess.polyglot
+
+
+def position_key(board, engine_color):
+    return chess.polyglot.zobrist_hash(board), board.ply(), bool(engine_color)
+
+
+class TreeStore:
+    """
+    PosLab nodes in sqlite keyed by Zobrist hash, ply and engine color of their position,
+    so that a position reached by transposition in the same number of moves is one node
+    and memory of played variations outlives the app. Ply keeps the graph free of cycles.
+    A node is read when first used, nodes changed since the last flush are written together.
+    Evaluations are not stored, they depend on the tree below and are recomputed.
+    """
+    program_data_path = os.path.join(os.path.expanduser('~'), '.chesslab')
+    db_path = os.path.join(program_data_path, 'poslab_tree.db')
+    fields = ('turn', 'lines', 'human_success', 'outcome', 'bookmark', 'fen')
+
+    def __init__(self, node_class, path=None):
+        self.node_class = node_class
+        self.path = path or self.db_path
+        self.con = None
+        self.nodes = weakref.WeakValueDictionary()
+        self.dirty = {}
+        self.lock = threading.RLock()
+
+    def connect(self):
+        if self.con is None:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.mkdir(os.path.dirname(self.path))
+            self.con = sqlite3.connect(self.path, check_same_thread=False)
+            self.con.execute("CREATE TABLE IF NOT EXISTS nodes (hash TEXT, ply INTEGER, engine_color INTEGER, "
+                             "children TEXT, data BLOB, PRIMARY KEY (hash, ply, engine_color))")
+            self.con.commit()
+        return self.con
+
+    def row(self, key):
+        zobrist, ply, engine_color = key
+        return self.connect().execute("SELECT children, data FROM nodes WHERE hash = ? AND ply = ? AND engine_color = ?",
+                                      (f"{zobrist:016x}", ply, int(engine_color))).fetchone()
+
+    def node(self, key):
+        """
+        Node of the position key, read from the database on first use of its fields.
+        """
+        with self.lock:
+            node = self.nodes.get(key)
+            if node is None:
+                node = self.node_class.__new__(self.node_class)
+                node.__dict__.update(key=key, store=self, unread=True)
+                self.nodes[key] = node
+            return node
+
+    def get(self, board, engine_color):
+        """
+        Node of the board position, a new one if the position was not reached before.
+        """
+        key = position_key(board, engine_color)
+        with self.lock:
+            if key in self.nodes or self.row(key) is not None:
+                return self.node(key)
+
+            node = self.node_class(board.turn)
+            node.key = key
+            node.store = self
+            self.nodes[key] = node
+            self.changed(node)
+            return node
+
+    def read_node(self, node):
+        with self.lock:
+            zobrist, ply, engine_color = node.key
+            row = self.row(node.key)
+            if row is None:
+                # position forgotten since the node was referenced
+                children, values = {}, (ply % 2 == 0, [], False, None, False, None)
+            else:
+                children = {uci: self.node((int(child, 16), ply + 1, engine_color))
+                            for uci, child in json.loads(row[0]).items()}
+                values = pickle.loads(row[1])
+
+            for child in children.values():
+                child.__dict__.setdefault('parents', []).append(node)
+            for name, value in zip(self.fields, values):
+                node.__dict__.setdefault(name, value)
+            node.__dict__.setdefault('children', children)
+            node.__dict__.setdefault('parent', None)
+            node.__dict__.setdefault('eval_score', None)
+
+    def changed(self, node):
+        with self.lock:
+            self.dirty[node.key] = node
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            rows = []
+            for (zobrist, ply, engine_color), node in self.dirty.items():
+                children = {uci: f"{child.key[0]:016x}" for uci, child in node.children.items()}
+                rows.append((f"{zobrist:016x}", ply, int(engine_color), json.dumps(children),
+                             pickle.dumps(tuple(getattr(node, name) for name in self.fields))))
+            self.connect().executemany("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?)", rows)
+            self.con.commit()
+            self.dirty.clear()
+
+    def forget(self, root):
+        """
+        Delete root and the positions reachable from it which no other position outside reaches,
+        as transpositions are shared with the trees of other roots. Returns how many were deleted.
+        """
+        with self.lock:
+            self.flush()
+            children = {}
+            stack = [root.key]
+            while stack:
+                key = stack.pop()
+                if key in children:
+                    continue
+                row = self.row(key)
+                zobrist, ply, engine_color = key
+                children[key] = ([(int(child, 16), ply + 1, engine_color) for child in json.loads(row[0]).values()]
+                                 if row is not None else [])
+                stack.extend(children[key])
+
+            # positions of the tree reached from positions outside it are kept with everything below them
+            stack = []
+            for zobrist, ply, engine_color, row_children in self.con.execute(
+                    "SELECT hash, ply, engine_color, children FROM nodes WHERE engine_color = ?", (int(root.key[2]),)):
+                if (int(zobrist, 16), ply, bool(engine_color)) not in children:
+                    stack.extend(key for key in ((int(child, 16), ply + 1, bool(engine_color))
+                                                 for child in json.loads(row_children).values()) if key in children)
+            kept = set()
+            while stack:
+                key = stack.pop()
+                if key not in kept:
+                    kept.add(key)
+                    stack.extend(children[key])
+
+            keys = [key for key in children if key not in kept]
+            self.con.executemany("DELETE FROM nodes WHERE hash = ? AND ply = ? AND engine_color = ?",
+                                 [(f"{zobrist:016x}", ply, int(engine_color)) for zobrist, ply, engine_color in keys])
+            self.con.commit()
+            for key in keys:
+                self.nodes.pop(key, None)
+            return len(keys)
+
+    def stats(self):
+        with self.lock:
+            count, = self.connect().execute("SELECT COUNT(*) FROM nodes").fetchone()
+            return f"positions={count} in memory={len(self.nodes)} unsaved={len(self.dirty)}"
@@ -0,0 +1,224 @@
+import os
+import pickle
+import struct
+import threading
+import traceback
+from queue import Queue
+
+import chess
+
+MAGIC = b'CHESSLAB SNAPSHOT'
+VERSION = 1
+
+file_header = struct.Struct('<H')
+# body length and kind
+record_header = struct.Struct('<IB')
+
+ATTR, BOARD = range(2)
+# app attribute holding the snapshot entries of attributes not decoded yet
+PENDING = 'snapshot_pending'
+
+
+def record(kind, body):
+    return record_header.pack(len(body), kind) + body
+
+
+def decode(entry):
+    if entry[0] == BOARD:
+        board = chess.Board(entry[1], chess960=entry[2])
+        for uci in entry[3]:
+            board.push(chess.Move.from_uci(uci))
+        return board
+    return pickle.loads(entry[1])[1]
+
+
+def entry(name, value):
+    if isinstance(value, chess.Board):
+        return BOARD, value.root().fen(), value.chess960, [move.uci() for move in value.move_stack]
+    return ATTR, pickle.dumps((name, value))
+
+
+class Restorable:
+    """
+    Object whose attributes loaded from a snapshot are decoded on first use.
+    """
+    def __getattr__(self, name):
+        # only for attributes not set
+        pending = self.__dict__.get(PENDING)
+        if not pending or name not in pending:
+            raise AttributeError(name)
+        value = decode(pending.pop(name))
+        self.__dict__[name] = value
+        return value
+
+
+class SnapshotFile:
+    """
+    Snapshot read into memory, the last record of each attribute is its value.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a chesslab snapshot")
+        version, = file_header.unpack_from(self.data, len(MAGIC))
+        if version != VERSION:
+            raise ValueError(f"{path} is a snapshot version {version}, expected {VERSION}")
+
+        self.state = {}
+        self.boards = {}
+        self.records = 0
+        offset = len(MAGIC) + file_header.size
+        while offset + record_header.size <= len(self.data):
+            length, kind = record_header.unpack_from(self.data, offset)
+            start = offset + record_header.size
+            end = start + length
+            if end > len(self.data):
+                # last record cut short while being appended
+                break
+
+            if kind == BOARD:
+                name, fen, chess960, keep, moves = pickle.loads(self.data[start:end])
+                previous = self.boards.get(name)
+                self.boards[name] = (BOARD, fen, chess960, (previous[3][:keep] if previous else []) + moves)
+                self.state[name] = self.boards[name]
+            else:
+                name, _ = pickle.loads(self.data[start:end])
+                self.state[name] = (ATTR, self.data[start:end])
+
+            self.records += 1
+            offset = end
+        # length of the whole records, anything after is a record cut short
+        self.size = offset
+
+    def app(self):
+        """
+        App of the snapshot, its attributes are decoded when first used, see Restorable.
+        """
+        pending = dict(self.state)
+        cls = decode(pending.pop('__class__'))
+        app = cls.__new__(cls)
+        app.__dict__[PENDING] = pending
+        return app
+
+    def journal(self):
+        journal = Journal()
+        journal.state = dict(self.state)
+        journal.records = self.records
+        return journal
+
+
+class Journal:
+    """
+    What a snapshot file holds, so that the next save appends records only for what changed since.
+    Attributes are compared by their pickles and boards by their moves.
+    """
+    def __init__(self):
+        self.state = {}
+        self.records = 0
+
+    def garbage(self):
+        return self.records > 2 * len(self.state) + 1000
+
+    def capture(self, app):
+        """
+        Records of app state not in the snapshot yet,
+        None if attributes were dropped since and the snapshot has to be rewritten.
+        Attributes of a loaded snapshot not decoded yet are kept as they were read.
+        """
+        state = app.__getstate__()
+        pending = state.pop(PENDING, {})
+        entries = {name: entry(name, value) for name, value in state.items()}
+        entries.update((name, pending_entry) for name, pending_entry in pending.items() if name not in entries)
+        entries['__class__'] = entry('__class__', type(app))
+        if self.state.keys() - entries.keys():
+            return None
+
+        records = []
+        for name, new in entries.items():
+            old = self.state.get(name)
+            if new != old:
+                if new[0] == BOARD:
+                    keep = 0
+                    if old is not None and old[:3] == new[:3]:
+                        while keep < min(len(old[3]), len(new[3])) and old[3][keep] == new[3][keep]:
+                            keep += 1
+                    records.append(record(BOARD, pickle.dumps((name, new[1], new[2], keep, new[3][keep:]))))
+                else:
+                    records.append(record(ATTR, new[1]))
+            self.state[name] = new
+
+        self.records += len(records)
+        return records
+
+
+class SnapshotWriter:
+    """
+    Writes snapshots on a background thread in the order they were saved.
+    """
+    def __init__(self):
+        self.queue = Queue()
+        self.thread = None
+
+    def put(self, path, records, append):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        self.queue.put((path, records, append))
+
+    def run(self):
+        while True:
+            path, records, append = self.queue.get()
+            try:
+                self.write(path, records, append)
+            except OSError:
+                journals.pop(path, None)
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    @staticmethod
+    def write(path, records, append):
+        if append:
+            with open(path, 'ab') as f:
+                f.writelines(records)
+        else:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(MAGIC + file_header.pack(VERSION))
+                f.writelines(records)
+            os.replace(path + '.tmp', path)
+
+    def flush(self):
+        self.queue.join()
+
+
+journals = {}
+snapshot_writer = SnapshotWriter()
+
+
+def save(app, path):
+    """
+    Append what changed since the last save to path to the snapshot in the background,
+    the first save in a session or after many changes rewrites the snapshot.
+    """
+    journal = journals.get(path)
+    if journal is not None and not journal.garbage() and os.path.isfile(path):
+        records = journal.capture(app)
+        if records is not None:
+            if records:
+                snapshot_writer.put(path, records, True)
+            return
+
+    journal = Journal()
+    journals[path] = journal
+    snapshot_writer.put(path, journal.capture(app), False)
+
+
+def load(path):
+    snapshot_writer.flush()
+    snapshot = SnapshotFile(path)
+    if snapshot.size < len(snapshot.data):
+        # the next save appends after the last whole record
+        os.truncate(path, snapshot.size)
+    journals[path] = snapshot.journal()
+    return snapshot.app()
@@ -1,14 +1,19 @@
 import os
+import io
 import sys
-import pandas as pd
+import csv
+import time
+import itertools
 import sqlite3
+import zstandard
 import chess
 from chesslab.engine import ChesslabEngine
 from chesslab.apps import MainApp, Payload
 from chesslab.apps.poslab import PosLab
 
-from chesslab.puzzle import Puzzle
-from chesslab.puzzle_provider import PuzzleProvider
+from chesslab.puzzle import Puzzle, verdict_cache
+from chesslab.puzzle_provider import PuzzleProvider, PuzzleRepository
+from chesslab.puzzle_verification import verify_puzzles
 from chess import Board
 from chess.engine import Limit
 
@@ -26,25 +31,133 @@ all commands available:
 """
     cmd = 'tactics'
     table_name = 'lichess_puzzle'
+    tags_table_name = 'lichess_puzzle_tags'
+    db_version = 2
+    integer_columns = {'Rating', 'RatingDeviation', 'Popularity', 'NbPlays'}
+    attrs_to_copy = PosLab.attrs_to_copy + ['themes', 'seed']
+    # puzzle positions are not remembered for later sessions nor analysed in advance
+    tree_store = None
+    replies = 0
+
+    @classmethod
+    def read_puzzles_csv(cls, source_path):
+        with open(source_path, "rb") as f:
+            stream = zstandard.ZstdDecompressor().stream_reader(f)
+            yield from csv.reader(io.TextIOWrapper(stream, encoding="utf-8", newline=""))
+
     @classmethod
-    def create_puzzles_db(cls, source_path):
-        if not os.path.exists(cls.puzzles_db_path):
-            print("creating puzzles database")
-            con = sqlite3.connect(cls.puzzles_db_path)
-            con.execute("PRAGMA journal_mode=OFF;")
-            con.execute(f"DROP TABLE IF EXISTS {cls.table_name};")
-            for chunk in pd.read_csv(source_path, chunksize=100000):
-                chunk.to_sql(name=cls.table_name, con=con, if_exists='append')
+    def puzzles_db_meta(cls, con):
+        con.execute("CREATE TABLE IF NOT EXISTS chesslab_meta (key TEXT PRIMARY KEY, value TEXT)")
+        return dict(con.execute("SELECT key, value FROM chesslab_meta"))
+
+    @classmethod
+    def create_tags_index(cls, con, meta):
+        """
+        FTS5 index over Themes and OpeningTags, tags are whole tokens e.g. Sicilian_Defense.
+        """
+        if meta.get('tags') == '1':
+            return
+
+        print("creating puzzle themes index")
+        with con:
+            con.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {cls.tags_table_name} USING fts5(Themes, OpeningTags, "
+                        f"content='{cls.table_name}', content_rowid='rowid', tokenize=\"unicode61 tokenchars '_'\")")
+            con.execute(f"INSERT INTO {cls.tags_table_name}({cls.tags_table_name}) VALUES('rebuild')")
+            con.execute("INSERT OR REPLACE INTO chesslab_meta VALUES ('tags', '1')")
+
+    @classmethod
+    def create_puzzles_db(cls, source_path, batch_size=200000):
+        """
+        Stream the zstd CSV into sqlite in large transactions and create indexes after the load.
+        Progress is committed together with each batch, so an interrupted run is resumed,
+        and a database of another version or from another source file is rebuilt.
+        """
+        stat = os.stat(source_path)
+        source = f"{os.path.basename(source_path)}:{stat.st_size}"
+        con = sqlite3.connect(cls.puzzles_db_path)
+        meta = cls.puzzles_db_meta(con)
+        if meta.get('version') == str(cls.db_version) and meta.get('source') == source and meta.get('complete') == '1':
+            cls.create_tags_index(con, meta)
+            con.close()
+            return
+
+        try:
+            con.execute("PRAGMA journal_mode=WAL;")
+            con.execute("PRAGMA synchronous=OFF;")
+            con.execute("PRAGMA cache_size=-200000;")
+            con.execute("PRAGMA temp_store=MEMORY;")
+
+            rows = cls.read_puzzles_csv(source_path)
+            columns = next(rows)
+            loaded = 0
+            if meta.get('version') == str(cls.db_version) and meta.get('source') == source:
+                loaded = int(meta.get('rows', 0))
+                print(f"resuming puzzles database from row {loaded}")
+            else:
+                print("creating puzzles database")
+                with con:
+                    con.execute(f"DROP TABLE IF EXISTS {cls.tags_table_name}")
+                    con.execute(f"DROP TABLE IF EXISTS {cls.table_name}")
+                    con.execute("DELETE FROM chesslab_meta")
+                    types = ", ".join(f"{column} {'INTEGER' if column in cls.integer_columns else 'TEXT'}" for column in columns)
+                    con.execute(f"CREATE TABLE {cls.table_name} ({types})")
+                    con.executemany("INSERT INTO chesslab_meta VALUES (?, ?)",
+                                    [('version', str(cls.db_version)), ('source', source), ('rows', '0'), ('complete', '0')])
+
+            integer_indices = [i for i, column in enumerate(columns) if column in cls.integer_columns]
+
+            def convert(row):
+                for i in integer_indices:
+                    row[i] = int(row[i])
+                return row
+
+            for _ in itertools.islice(rows, loaded):
+                pass
+
+            start = time.time()
+            inserted = 0
+            insert = f"INSERT INTO {cls.table_name} VALUES ({', '.join('?' * len(columns))})"
+            while True:
+                batch = [convert(row) for row in itertools.islice(rows, batch_size)]
+                if not batch:
+                    break
+                with con:
+                    con.executemany(insert, batch)
+                    loaded += len(batch)
+                    con.execute("UPDATE chesslab_meta SET value = ? WHERE key = 'rows'", (str(loaded),))
+                inserted += len(batch)
                 sys.stdout.write('.')
                 sys.stdout.flush()
-            con.execute(f"CREATE INDEX puzzle_search_index ON {cls.table_name}(PuzzleId, Rating, Popularity, NbPlays)")
-            con.commit()
+
+            with con:
+                con.execute(f"CREATE INDEX IF NOT EXISTS puzzle_search_index ON {cls.table_name}(PuzzleId, Rating, Popularity, NbPlays)")
+                con.execute("UPDATE chesslab_meta SET value = '1' WHERE key = 'complete'")
+            cls.create_tags_index(con, {})
+            con.execute("PRAGMA journal_mode=DELETE;")
+        finally:
             con.close()
 
+        elapsed = time.time() - start
+        print(f"\n{inserted} puzzles in {elapsed:.1f} sec ({inserted / max(elapsed, 1e-9):.0f} rows/sec)")
+
+    @classmethod
+    def verify_puzzles_db(cls, engine_path, limit=Limit(time=0.5), margin=150, workers=None, options=None, count=None):
+        """
+        Verify solutions of puzzles in the database with the engine, see verify_puzzles.
+        Puzzles found broken are not used for training.
+        """
+        return verify_puzzles(cls.puzzles_db_path, cls.table_name, engine_path, limit=limit, margin=margin,
+                              workers=workers, options=options, count=count)
+
+    @classmethod
+    def create_from(cls, obj):
+        app = super().create_from(obj)
+        # the puzzle provider was made before ratings, probs and themes were copied
+        app.create_puzzle_provider()
+        return app
+
     def __init__(self, main_app=None):
         PosLab.__init__(self, main_app)
-        if main_app is not None:
-            main_app.copy_attrs(self)
 
         if not hasattr(self, 'ratings') or self.ratings is None:
             self.ratings = [1400, 1500, 1700, 2000]
@@ -52,6 +165,15 @@ all commands available:
         if not hasattr(self, 'probs') or self.probs is None:
             self.probs = [0.5, 0.2, 0.2, 0.1]
 
+        if not hasattr(self, 'themes'):
+            self.themes = None
+
+        if not hasattr(self, 'seed'):
+            self.seed = None
+
+        if main_app is not None:
+            main_app.copy_attrs(self)
+
         if not hasattr(self, 'pp') or self.pp is None:
             self.create_puzzle_provider()
 
@@ -68,31 +190,79 @@ all commands available:
         self.board = Board(self.fen)
         self.engine_color = not self.board.turn
 
-    def create_puzzle_provider(self):
-        con = sqlite3.connect(self.puzzles_db_path)
-        training_sets = [PuzzleProvider.create_set_from_sqlite(con, table_name=self.table_name, rating=rating) for rating in self.ratings]
-        con.close()
-        if len(self.ratings) != len(self.probs):
+    def make_puzzle_provider(self, ratings, probs, themes):
+        repository = PuzzleRepository.open(self.puzzles_db_path, self.table_name, self.tags_table_name)
+        training_sets = [repository.create_set(rating=rating, themes=themes) for rating in ratings]
+        if len(ratings) != len(probs):
             raise Exception("there must be the same ratings as probs")
-        self.pp = PuzzleProvider(training_sets=training_sets, weights=self.probs)
-        self.pp.rnd_flipped = True
+        weights = [prob if len(training_set) else 0 for prob, training_set in zip(probs, training_sets)]
+        if not any(weights):
+            raise Exception("no puzzles for given ratings and themes")
+        pp = PuzzleProvider(training_sets=training_sets, weights=weights, repository=repository, seed=self.seed)
+        pp.rnd_flipped = True
+        return pp
+
+    def set_puzzle_provider(self, pp):
+        if getattr(self, 'pp', None) is not None:
+            self.pp.close()
+        self.pp = pp
+
+    def create_puzzle_provider(self):
+        self.set_puzzle_provider(self.make_puzzle_provider(self.ratings, self.probs, self.themes))
 
     def next_puzzle(self):
-        con = sqlite3.connect(self.puzzles_db_path)
-        self.puzzle = self.pp.next_puzzle(con, self.table_name)
-        con.close()
+        self.puzzle = self.pp.next_puzzle()
 
     def start(self):
         yield self.payload(f"TacticsLab\n{MainApp.copyright_str}")
         yield from self._info()
 
     def _ratings(self, *args):
-        self.ratings = list(map(int, args))
-        self.create_puzzle_provider()
+        ratings = list(map(int, args))
+        pp = self.make_puzzle_provider(ratings, self.probs, self.themes)
+        self.ratings = ratings
+        self.set_puzzle_provider(pp)
 
     def _probs(self, *args):
-        self.probs = list(map(float, args))
+        probs = list(map(float, args))
+        pp = self.make_puzzle_provider(self.ratings, probs, self.themes)
+        self.probs = probs
+        self.set_puzzle_provider(pp)
+
+    def _themes(self, *args):
+        """
+Train only on puzzles with given Lichess themes or opening tags.
+Themes can be combined with AND, OR, NOT and parentheses, a * suffix matches a prefix.
+Puzzles are still chosen according to ratings and probs.
+
+themes <query>
+themes off
+
+e.g.
+themes fork AND endgame
+themes mateIn2 OR mateIn3
+themes Sicilian_Defense* NOT crushing
+"""
+        if args:
+            themes = None if args == ('off',) else " ".join(args)
+            pp = self.make_puzzle_provider(self.ratings, self.probs, themes)
+            self.themes = themes
+            self.set_puzzle_provider(pp)
+            sizes = [len(training_set) for training_set in self.pp.training_sets]
+            yield Payload.text(f"themes {self.themes or 'off'}, puzzles per rating {dict(zip(self.ratings, sizes))}")
+        else:
+            yield Payload.text(f"themes {self.themes or 'off'}")
+
+    def _seed(self, value: int = None):
+        """
+Make the sequence of puzzles reproducible. Without argument puzzles are random again.
+
+seed [<value: int>]
+
+e.g. seed 2024"""
+        self.seed = value
         self.create_puzzle_provider()
+        yield Payload.text(f"seed {self.seed}")
 
     def _info(self):
         """
@@ -114,13 +284,23 @@ Next randomly chosen puzzle from predefined set.
         yield from PosLab._fen(self, self.puzzle.fen)
 
     def _puzzle(self, value: str):
-        con = sqlite3.connect(self.puzzles_db_path)
-        self.puzzle = self.pp.get_puzzle(con, self.table_name, value)
-        con.close()
+        self.puzzle = self.pp.get_puzzle(value)
         self.engine_color = not self.puzzle.board.turn
         yield from self._info()
         yield from PosLab._fen(self, self.puzzle.fen)
 
+    def _check(self, move_san: str):
+        """
+Check if a move solves the puzzle without playing it.
+Another move than the lichess.org solution is accepted if it mates as well.
+
+check <move_san: str>
+
+e.g. check Qxf7+"""
+        correct = self.puzzle.check_solution(move_san, self.engine_path)
+        source, _, latency = verdict_cache.last
+        yield Payload.text(f"{move_san} {'correct' if correct else 'wrong'} ({source}, {1000 * latency:.1f} ms)")
+
     def _solve(self):
         """
 Show solution as provided by lichess.org.
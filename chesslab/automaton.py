@@ -2,13 +2,14 @@ from chesslab.evaluator import evaluate, Selector
 
 
 class Automaton:
-    def __init__(self, engine, limit, selector: Selector):
+    def __init__(self, engine, limit, selector: Selector, evaluator=evaluate):
         self.engine = engine
         self.limit = limit
         self.selector = selector
+        self.evaluator = evaluator
 
     def move(self, board):
-        evaluation = evaluate(board, self.engine, self.limit)
+        evaluation = self.evaluator(board, self.engine, self.limit)
         mov = self.selector.select_move(evaluation)
         board.push(mov)
         return board
@@ -1,16 +1,346 @@
+import io
+import os
+import json
+import bisect
 import time
+from collections import OrderedDict
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
 import chess.pgn
-from chess.engine import Limit
+from chess.engine import SimpleEngine, Limit
 from chesslab.game_score import GameScore
 
+HEADER_SLACK = 64
+
+worker_engine = None
+
+
+def insort(items, item, key):
+    """
+    bisect.insort with key, which bisect supports only since Python 3.10.
+    """
+    keys = [key(other) for other in items]
+    items.insert(bisect.bisect_right(keys, key(item)), item)
+
+
+def init_score_worker(engine_path, options):
+    global worker_engine
+    worker_engine = SimpleEngine.popen_uci(engine_path)
+    if options:
+        worker_engine.configure(options)
+    Finalize(None, worker_engine.quit, exitpriority=10)
+
+
+def score_game_worker(task):
+    index, pgn_string, limit, single_pass = task
+    game = chess.pgn.read_game(io.StringIO(pgn_string))
+    score = GameScore(game, worker_engine, limit, single_pass=single_pass, verbose=False).score()
+    return index, score
+
+
+class IndexedGame:
+    """
+    Headers of a game and byte range of its PGN text in the collection file.
+    game is set only for games added in memory, pending is the byte range of a replaced game
+    in the pending file until the collection is saved.
+    """
+    def __init__(self, headers, start=None, end=None, game=None):
+        self.headers = headers
+        self.start = start
+        self.end = end
+        self.game = game
+        self.pending = None
+        self.headers_hash = self.hash_headers()
+
+    def hash_headers(self):
+        return hash(tuple(self.headers.items()))
+
+    def is_dirty(self):
+        return (self.game is not None or self.start is None or self.pending is not None
+                or self.hash_headers() != self.headers_hash)
+
+    def needs_export(self):
+        return (self.game is not None or (self.start is None and self.pending is None)
+                or self.hash_headers() != self.headers_hash)
+
+
+class GameIndex:
+    """
+    Sequence of games of a PGN file backed by a byte offset index stored in a sidecar file.
+    Games are parsed on demand and kept in an LRU cache of cache_size games.
+    Materialized games share headers with the index, so header changes survive eviction.
+    Changes to moves must be assigned back with games[i] = game. A game assigned back is written
+    to a pending file next to the collection rather than kept in memory, until the collection is saved.
+    """
+    def __init__(self, path, cache_size=256):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.pending_path = path + '.pending'
+        self.pending = None
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.entries = self.load_index()
+
+    def file_stamp(self):
+        stat = os.stat(self.path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def load_index(self):
+        if not os.path.isfile(self.path):
+            return []
+
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                index = json.load(f)
+            if index['stamp'] == self.file_stamp():
+                return [IndexedGame(chess.pgn.Headers(headers), start, end) for start, end, headers in index['games']]
+
+        entries = self.scan()
+        self.save_index(entries)
+        return entries
+
+    def save_index(self, entries):
+        index = {'stamp': self.file_stamp(),
+                 'games': [[entry.start, entry.end, list(entry.headers.items())] for entry in entries]}
+        with open(self.index_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+
+    def scan(self):
+        entries = []
+        headers = []
+        start = None
+        in_moves = True
+        pos = 0
+        with open(self.path, "rb") as f:
+            for raw_line in f:
+                line = raw_line.decode("utf-8", errors="replace").lstrip("\ufeff")
+                tag_match = chess.pgn.TAG_REGEX.match(line)
+                if tag_match:
+                    if in_moves:
+                        if start is not None:
+                            entries.append(IndexedGame(chess.pgn.Headers(headers), start, pos))
+                        headers = []
+                        start = pos
+                        in_moves = False
+                    headers.append(tag_match.groups())
+                elif line.strip():
+                    in_moves = True
+
+                pos += len(raw_line)
+
+        if start is not None:
+            entries.append(IndexedGame(chess.pgn.Headers(headers), start, pos))
+
+        return entries
+
+    def read_raw(self, entry):
+        if entry.pending is not None:
+            start, end = entry.pending
+            self.pending.seek(start)
+            return self.pending.read(end - start)
+
+        with open(self.path, "rb") as f:
+            f.seek(entry.start)
+            return f.read(entry.end - entry.start)
+
+    def write_pending(self, entry, game):
+        if self.pending is None:
+            self.pending = open(self.pending_path, "w+b")
+        data = self.export_game(game)
+        start = self.pending.seek(0, os.SEEK_END)
+        self.pending.write(data)
+        entry.pending = (start, start + len(data))
+
+    def release_pending(self):
+        for entry in self.entries:
+            entry.pending = None
+        if self.pending is not None:
+            self.pending.close()
+            self.pending = None
+            os.remove(self.pending_path)
+
+    def materialize(self, entry):
+        if entry.game is not None:
+            return entry.game
+
+        if entry in self.cache:
+            self.cache.move_to_end(entry)
+            return self.cache[entry]
+
+        game = chess.pgn.read_game(io.StringIO(self.read_raw(entry).decode("utf-8-sig", errors="replace")))
+        game.headers = entry.headers
+        self.cache[entry] = game
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return game
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.materialize(entry) for entry in self.entries[i]]
+        return self.materialize(self.entries[i])
+
+    def __setitem__(self, i, game):
+        entry = self.entries[i]
+        self.write_pending(entry, game)
+        entry.game = None
+        entry.headers = game.headers
+        entry.headers_hash = entry.hash_headers()
+        self.cache[entry] = game
+        self.cache.move_to_end(entry)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def __iter__(self):
+        for entry in self.entries:
+            yield self.materialize(entry)
+
+    def append(self, game):
+        self.entries.append(IndexedGame(game.headers, game=game))
+
+    def sort(self, key):
+        """
+        key gets IndexedGame which has only headers, so games are not parsed.
+        """
+        self.entries.sort(key=key)
+
+    def insort(self, game, key):
+        insort(self.entries, IndexedGame(game.headers, game=game), key)
+
+    def export(self, entry):
+        """
+        PGN of a game with HEADER_SLACK trailing spaces after the last header,
+        so later header changes can be patched in place.
+        """
+        return self.export_game(entry.game if entry.game is not None else self.materialize(entry))
+
+    @staticmethod
+    def export_game(game):
+        text = game.accept(chess.pgn.StringExporter())
+        headers, sep, moves = text.partition("\n\n")
+        return (headers + " " * HEADER_SLACK + sep + moves + "\n\n").encode("utf-8")
+
+    @staticmethod
+    def headers_size(raw):
+        size = 0
+        newline = b"\n"
+        for line in raw.splitlines(keepends=True):
+            if not chess.pgn.TAG_REGEX.match(line.decode("utf-8", errors="replace").lstrip("\ufeff")):
+                break
+            size += len(line)
+            newline = b"\r\n" if line.endswith(b"\r\n") else b"\n"
+
+        return size, newline
+
+    def with_slack(self, raw):
+        size, newline = self.headers_size(raw)
+        if not size:
+            return raw
+
+        last_line = raw[:size - len(newline)].rsplit(b"\n", 1)[-1]
+        missing = HEADER_SLACK - (len(last_line) - len(last_line.rstrip(b" ")))
+        if missing <= 0:
+            return raw
+
+        return raw[:size - len(newline)] + b" " * missing + raw[size - len(newline):]
+
+    def patch_headers(self, f, entry):
+        size, newline = self.headers_size(self.read_raw(entry))
+        lines = [f'[{name} "{value}"]'.encode("utf-8") for name, value in entry.headers.items()]
+        data = newline.join(lines)
+        if not lines or len(data) + len(newline) > size:
+            return False
+
+        f.seek(entry.start)
+        f.write(data + b" " * (size - len(data) - len(newline)) + newline)
+        return True
+
+    def save(self):
+        """
+        Games added at the end are appended and changed headers are patched in place.
+        Anything else (new order, changed moves, headers without enough room) compacts the file,
+        as does a collection without a file yet.
+        """
+        if not os.path.isfile(self.path):
+            self.compact()
+            return
+
+        starts = [entry.start for entry in self.entries if entry.start is not None]
+        appended = [entry for entry in self.entries if entry.start is None]
+        if (any(a >= b for a, b in zip(starts, starts[1:]))
+                or any(entry.start is not None and (entry.game is not None or entry.pending is not None)
+                       for entry in self.entries)
+                or any(entry.start is not None for entry in self.entries[len(self.entries) - len(appended):])):
+            self.compact()
+            return
+
+        with open(self.path, "r+b") as f:
+            for entry in self.entries:
+                if entry.start is not None and entry.is_dirty():
+                    if not self.patch_headers(f, entry):
+                        f.close()
+                        self.compact()
+                        return
+                    entry.headers_hash = entry.hash_headers()
+
+            pos = f.seek(0, os.SEEK_END)
+            if appended and pos:
+                f.seek(max(pos - 2, 0))
+                tail = f.read()
+                if not tail.endswith(b"\n\n"):
+                    pos += f.write(b"\n" if tail.endswith(b"\n") else b"\n\n")
+
+            for entry in appended:
+                data = self.export(entry) if entry.needs_export() else self.read_raw(entry)
+                f.write(data)
+                entry.start, entry.end, entry.game = pos, pos + len(data), None
+                entry.headers_hash = entry.hash_headers()
+                pos += len(data)
+
+        self.release_pending()
+        self.save_index(self.entries)
+
+    def compact(self):
+        """
+        Rewrite the whole file into a temporary one and atomically rename it,
+        so a crash can't leave a truncated collection.
+        """
+        tmp_path = self.path + '.tmp'
+        ranges = []
+        pos = 0
+        with open(tmp_path, "wb") as f:
+            for entry in self.entries:
+                data = self.export(entry) if entry.needs_export() else self.with_slack(self.read_raw(entry))
+                f.write(data)
+                ranges.append((pos, pos + len(data)))
+                pos += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self.path)
+        for entry, (start, end) in zip(self.entries, ranges):
+            entry.start, entry.end, entry.game = start, end, None
+            entry.headers_hash = entry.hash_headers()
+        self.release_pending()
+        self.save_index(self.entries)
+
 
 class Collection:
-    def __init__(self, path):
+    def __init__(self, path, lazy=False, cache_size=256):
         self.path = path
+        self.lazy = lazy
+        self.cache_size = cache_size
         self.games = []
         self.load()
 
     def load(self):
+        if self.lazy:
+            self.games = GameIndex(self.path, self.cache_size)
+            return
+
         with open(self.path) as pgn:
             while True:
                 game = chess.pgn.read_game(pgn)
@@ -18,18 +348,50 @@ class Collection:
                     break
                 self.games.append(game)
 
-    def compute_scores_and_save(self, engine, limit=Limit(time=0.5), overwrite=False):
+    def compute_scores_and_save(self, engine, limit=Limit(time=0.5), overwrite=False, single_pass=False):
         start = time.time()
         for i, game in enumerate(self.games):
             if overwrite or ('WhiteScore' not in game.headers):
                 print(f"game {i + 1}")
-                gs = GameScore(game, engine, limit)
+                gs = GameScore(game, engine, limit, single_pass=single_pass)
                 score = gs.score()
                 game.headers["WhiteScore"] = str(round(score['white'], 2))
                 game.headers["BlackScore"] = str(round(score['black'], 2))
                 self.save()
                 print(f"{round(time.time() - start)} sec")
 
+    def compute_scores_parallel_and_save(self, engine_path, limit=Limit(time=0.5), overwrite=False, single_pass=False,
+                                         workers=None, options=None, checkpoint=20):
+        """
+        Score games in a pool of worker processes, each with its own engine.
+        Games already having WhiteScore are skipped unless overwrite, so an interrupted run resumes.
+        The collection is saved every checkpoint scored games and once at the end.
+        A lazy collection patches the score headers of the saved games in place, after the first save
+        has rewritten a file not saved by it before with room for them. A collection loaded whole
+        does not know where its games are in the file, so each checkpoint rewrites the file.
+        """
+        start = time.time()
+        tasks = [(i, str(self.remove_comments_and_variations_for_game(game)), limit, single_pass)
+                 for i, game in enumerate(self.games) if overwrite or ('WhiteScore' not in game.headers)]
+        if not tasks:
+            return
+
+        done = 0
+        with Pool(processes=workers, initializer=init_score_worker, initargs=(engine_path, options)) as pool:
+            try:
+                for i, score in pool.imap_unordered(score_game_worker, tasks):
+                    game = self.games[i]
+                    game.headers["WhiteScore"] = str(round(score['white'], 2))
+                    game.headers["BlackScore"] = str(round(score['black'], 2))
+                    done += 1
+                    print(f"game {i + 1} ({done}/{len(tasks)}) {round(time.time() - start)} sec")
+                    if done % checkpoint == 0:
+                        self.save()
+                pool.close()
+                pool.join()
+            finally:
+                self.save()
+
     def remove_comments_and_variations_for_game(self, original_game):
         clean_game = chess.pgn.Game()
 
@@ -47,21 +409,33 @@ class Collection:
         return clean_game
 
     def remove_comments_and_variations(self):
-        clean_games = []
-        for game in self.games:
-            clean_games.append(self.remove_comments_and_variations_for_game(game))
-        self.games = clean_games
+        for i, game in enumerate(self.games):
+            self.games[i] = self.remove_comments_and_variations_for_game(game)
 
-    def sort(self, key=lambda game: game.headers['Date']):
+    @staticmethod
+    def date_key(game):
+        return game.headers['Date']
+
+    def sort(self, key=date_key):
         self.games.sort(key=key)
 
     def add_game(self, game, compute_score_save=True):
-        self.games.append(game)
-        self.sort()
+        if self.lazy:
+            self.games.insort(game, key=self.date_key)
+        else:
+            insort(self.games, game, self.date_key)
 
     def save(self):
+        if self.lazy:
+            self.games.save()
+            return
+
         if self.games:
-            with open(self.path, "w", encoding="utf-8") as pgn:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, "w", encoding="utf-8") as pgn:
                 exporter = chess.pgn.FileExporter(pgn)
                 for game in self.games:
                     game.accept(exporter)
+                pgn.flush()
+                os.fsync(pgn.fileno())
+            os.replace(tmp_path, self.path)
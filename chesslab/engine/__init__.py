@@ -1,7 +1,10 @@
 import subprocess
+import threading
 from collections import defaultdict
+from contextlib import contextmanager
 import chess.pgn
-from chess.engine import SimpleEngine, Limit, PovScore, Info
+from chess.engine import SimpleEngine, Limit, PovScore, Info, EngineError, EngineTerminatedError
+from chesslab.engine.cache import analysis_cache, engine_key
 
 
 class Line:
@@ -53,24 +56,139 @@ class Line:
 
 
 class ChesslabEngine:
-    def __init__(self, path):
+    def __init__(self, path, options=None):
+        self.path = path
+        self.options = dict(options) if options else {}
+        self.cache_key = engine_key(path, self.options)
+        self.game = None
         self.engine = SimpleEngine.popen_uci(path)
+        if self.options:
+            self.engine.configure(self.options)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exception_type, exception_value, exception_traceback):
-        self.engine.quit()
+        self.quit()
 
-    def analysis(self, board, limit):
-        return self.engine.analysis(board, limit)
+    def quit(self):
+        try:
+            self.engine.quit()
+        except (EngineError, TimeoutError):
+            self.engine.close()
+
+    def is_alive(self):
+        return not self.engine.protocol.returncode.done()
+
+    def analysis(self, board, limit, multipv=None):
+        return self.engine.analysis(board, limit, multipv=multipv, game=self.game)
+
+    def analyse(self, board, limit, multipv, cache=analysis_cache):
+        analysis = None
+        if cache is not None:
+            analysis = cache.get(self.cache_key, board, limit, multipv)
+
+        if analysis is None:
+            analysis = self.engine.analyse(board, limit=limit, multipv=multipv, game=self.game)
+            if cache is not None:
+                cache.put(self.cache_key, board, limit, multipv, analysis)
 
-    def analyse(self, board, limit, multipv):
         res = []
-        analysis = self.engine.analyse(board, limit=limit, multipv=multipv)
         for info in analysis:
             res.append(Line(info))
 
         return res
 
 
+class EnginePool:
+    """
+    Keeps warm engine processes alive between commands.
+    Engines are keyed by path and options and handed out with lease().
+    A process using the pool has to close() it before exiting: SimpleEngine threads are not daemonic
+    and are joined before atexit handlers run, so idle engines would keep the process alive.
+    """
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.idle = defaultdict(list)
+        self.lock = threading.Lock()
+        self.started = 0
+        self.reused = 0
+        self.replaced = 0
+
+    def reserve(self, count):
+        """
+        Keep idle up to count engines of a kind, for count workers leasing engines at once.
+        """
+        with self.lock:
+            self.max_idle = max(self.max_idle, count)
+
+    @staticmethod
+    def key(path, options=None):
+        return path, tuple(sorted((options or {}).items()))
+
+    def acquire(self, path, options=None):
+        key = self.key(path, options)
+        with self.lock:
+            while self.idle[key]:
+                engine = self.idle[key].pop()
+                if engine.is_alive():
+                    self.reused += 1
+                    return engine
+                self.replaced += 1
+                engine.quit()
+            self.started += 1
+
+        return ChesslabEngine(path, options)
+
+    def release(self, engine):
+        if not engine.is_alive():
+            engine.quit()
+            return
+
+        key = self.key(engine.path, engine.options)
+        with self.lock:
+            if len(self.idle[key]) < self.max_idle:
+                self.idle[key].append(engine)
+                return
+
+        engine.quit()
+
+    def discard(self, engine):
+        with self.lock:
+            self.replaced += 1
+        engine.quit()
+
+    @contextmanager
+    def lease(self, path, options=None, game=None):
+        """
+        game is any object identifying the game being played,
+        ucinewgame is sent only when it differs from the previous lease.
+        """
+        engine = self.acquire(path, options)
+        engine.game = game
+        try:
+            yield engine
+        except (EngineError, EngineTerminatedError):
+            self.discard(engine)
+            raise
+        except BaseException:
+            self.release(engine)
+            raise
+        else:
+            self.release(engine)
+
+    def close(self):
+        with self.lock:
+            engines = [engine for engines in self.idle.values() for engine in engines]
+            self.idle.clear()
+
+        for engine in engines:
+            engine.quit()
+
+    def stats(self):
+        with self.lock:
+            idle = sum(len(engines) for engines in self.idle.values())
+        return f"engines started={self.started} reused={self.reused} replaced={self.replaced} idle={idle}"
+
+
+engine_pool = EnginePool()
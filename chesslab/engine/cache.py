@@ -0,0 +1,207 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import chess
+import chess.polyglot
+from chess import Move
+from chess.engine import PovScore, Cp, Mate
+
+LIMIT_FIELDS = ('time', 'depth', 'nodes', 'mate')
+# the engine manages its time from the clock, so a search with a clock is not comparable to another
+CLOCK_FIELDS = ('white_clock', 'black_clock', 'white_inc', 'black_inc', 'remaining_moves')
+
+
+def limit_key(limit):
+    """
+    Fields and values of the limit, None if its results are not cached.
+    """
+    if any(getattr(limit, name) is not None for name in CLOCK_FIELDS):
+        return None
+    fields = tuple(name for name in LIMIT_FIELDS if getattr(limit, name) is not None)
+    if not fields:
+        return None
+    values = tuple(getattr(limit, name) for name in fields)
+    return fields, values
+
+
+def satisfies(fields, values, requested):
+    """
+    A deeper search answers a shallower request, except for nodes, which set the playing strength of an engine.
+    """
+    return all(value == request if name == 'nodes' else value >= request
+               for name, value, request in zip(fields, values, requested))
+
+
+def engine_key(path, options=None):
+    """
+    Engine binary and its options, lines of another engine or the same engine configured otherwise are not reused.
+    """
+    return repr((path, tuple(sorted((options or {}).items()))))
+
+
+def score_to_str(score):
+    white = score.white()
+    if white.is_mate():
+        return f"mate {white.mate()}"
+    return f"cp {white.score()}"
+
+
+def score_from_str(text):
+    kind, value = text.split()
+    if kind == 'mate':
+        return PovScore(Mate(int(value)), chess.WHITE)
+    return PovScore(Cp(int(value)), chess.WHITE)
+
+
+def info_to_json(info):
+    return {'score': score_to_str(info['score']),
+            'pv': " ".join(move.uci() for move in info.get('pv', [])),
+            'nodes': info.get('nodes', 0),
+            'depth': info.get('depth', 0)}
+
+
+def info_from_json(data):
+    info = {'score': score_from_str(data['score']), 'nodes': data['nodes'], 'depth': data['depth']}
+    if data['pv']:
+        info['pv'] = [Move.from_uci(uci) for uci in data['pv'].split()]
+    return info
+
+
+class AnalysisCache:
+    """
+    Analysis results keyed by Zobrist hash of the position, engine, limit and multipv.
+    A result of a deeper search (every limit value greater or equal, nodes equal)
+    with at least as many lines satisfies a shallower request. Searches limited by the clock are not cached.
+    """
+    program_data_path = os.path.join(os.path.expanduser('~'), '.chesslab')
+    db_path = os.path.join(program_data_path, 'analysis_cache.db')
+
+    def __init__(self, max_positions=10000):
+        self.max_positions = max_positions
+        self.memory = OrderedDict()
+        self.con = None
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def use_disk(self, on=True, path=None):
+        with self.lock:
+            if self.con is not None:
+                self.con.close()
+                self.con = None
+            if not on:
+                return
+
+            path = path or self.db_path
+            if not os.path.isdir(os.path.dirname(path)):
+                os.mkdir(os.path.dirname(path))
+            self.con = sqlite3.connect(path, check_same_thread=False)
+            self.con.execute("PRAGMA journal_mode=WAL;")
+            columns = [row[1] for row in self.con.execute("PRAGMA table_info(analysis)")]
+            if columns and 'engine' not in columns:
+                # lines cached before the engine was part of the key are of an unknown engine
+                self.con.execute("DROP TABLE analysis")
+            self.con.execute("CREATE TABLE IF NOT EXISTS analysis (hash TEXT, engine TEXT, fields TEXT, vals TEXT, "
+                             "multipv INTEGER, lines TEXT)")
+            self.con.execute("CREATE INDEX IF NOT EXISTS analysis_engine_index ON analysis(hash, engine, fields)")
+            self.con.commit()
+
+    def get(self, engine, board, limit, multipv):
+        """
+        Infos of a search of the board position by the engine given by engine_key, None if not cached.
+        """
+        limit_values = limit_key(limit)
+        if limit_values is None:
+            return None
+        fields, values = limit_values
+        key = (chess.polyglot.zobrist_hash(board), engine, fields)
+        with self.lock:
+            infos = self.get_from_memory(key, values, multipv)
+            if infos is not None:
+                self.memory_hits += 1
+                return infos
+
+            infos = self.get_from_disk(key, values, multipv)
+            if infos is not None:
+                self.disk_hits += 1
+                return infos
+
+            self.misses += 1
+            return None
+
+    def get_from_memory(self, key, values, multipv):
+        if key not in self.memory:
+            return None
+
+        self.memory.move_to_end(key)
+        for entry_values, entry_multipv, infos in self.memory[key]:
+            if entry_multipv >= multipv and satisfies(key[2], entry_values, values):
+                return infos[:multipv]
+
+        return None
+
+    def get_from_disk(self, key, values, multipv):
+        if self.con is None:
+            return None
+
+        zobrist, engine, fields = key
+        rows = self.con.execute("SELECT vals, multipv, lines FROM analysis WHERE hash = ? AND engine = ? AND fields = ? "
+                                "AND multipv >= ?", (f"{zobrist:016x}", engine, ",".join(fields), multipv))
+        for vals, entry_multipv, lines in rows:
+            entry_values = tuple(json.loads(vals))
+            if satisfies(fields, entry_values, values):
+                infos = [info_from_json(data) for data in json.loads(lines)]
+                self.put_to_memory(key, entry_values, entry_multipv, infos)
+                return infos[:multipv]
+
+        return None
+
+    def put(self, engine, board, limit, multipv, infos):
+        limit_values = limit_key(limit)
+        if limit_values is None:
+            return
+        fields, values = limit_values
+        key = (chess.polyglot.zobrist_hash(board), engine, fields)
+        infos = [{name: info[name] for name in ('score', 'pv', 'nodes', 'depth') if name in info}
+                 for info in infos if 'score' in info]
+        with self.lock:
+            self.put_to_memory(key, values, multipv, infos)
+            if self.con is not None:
+                zobrist, engine, fields = key
+                self.con.execute("INSERT INTO analysis VALUES (?, ?, ?, ?, ?, ?)",
+                                 (f"{zobrist:016x}", engine, ",".join(fields), json.dumps(values), multipv,
+                                  json.dumps([info_to_json(info) for info in infos])))
+                self.con.commit()
+
+    def put_to_memory(self, key, values, multipv, infos):
+        entries = [(entry_values, entry_multipv, entry_infos)
+                   for entry_values, entry_multipv, entry_infos in self.memory.get(key, [])
+                   if not (multipv >= entry_multipv and satisfies(key[2], values, entry_values))]
+        entries.append((values, multipv, infos))
+        self.memory[key] = entries
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_positions:
+            self.memory.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.con is not None:
+                self.con.execute("DELETE FROM analysis")
+                self.con.commit()
+            self.memory_hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+
+    def stats(self):
+        requests = self.memory_hits + self.disk_hits + self.misses
+        hit_rate = 100 * (self.memory_hits + self.disk_hits) / requests if requests else 0
+        return (f"memory hits={self.memory_hits} disk hits={self.disk_hits} misses={self.misses} "
+                f"hit rate={hit_rate:.1f}% positions={len(self.memory)} disk={'on' if self.con is not None else 'off'}")
+
+
+analysis_cache = AnalysisCache()
@@ -1,6 +1,12 @@
+import os
 import random
+import queue
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from chess import Board, Move, Color
+from chess.engine import Limit
+
+from chesslab.engine import engine_pool
 
 
 class Evaluation:
@@ -25,6 +31,71 @@ def evaluate(board, engine, limit):
     return Evaluation(board.turn, res)
 
 
+def evaluate_multipv(board, engine, limit):
+    """
+    Evaluation of all legal moves from a single root search with multipv, the work of evaluate in one search.
+    For a depth limit d the root is searched to depth d + 1 and root depth k is stored as depth k - 1,
+    the depth of a search after the move, so the result has the depths of evaluate.
+    Time and nodes limits are given to the root search for all moves together,
+    other limits have no equivalent root search and evaluate is used.
+    """
+    moves = board.legal_moves.count()
+    if limit.depth is not None and limit.time is None and limit.nodes is None and limit.mate is None:
+        root_limit = Limit(depth=limit.depth + 1)
+    elif (limit.time is not None or limit.nodes is not None) and limit.depth is None and limit.mate is None:
+        root_limit = Limit(time=limit.time * moves if limit.time is not None else None,
+                           nodes=limit.nodes * moves if limit.nodes is not None else None)
+    else:
+        return evaluate(board, engine, limit)
+
+    res = {mov.uci(): {} for mov in board.legal_moves}
+    analysis = engine.analysis(board, root_limit, multipv=moves)
+    for info in analysis:
+        if 'depth' in info and 'score' in info and info.get('pv') and info['depth'] > 1:
+            res[info['pv'][0].uci()][info['depth'] - 1] = info['score']
+
+    return Evaluation(board.turn, {key: value for key, value in res.items() if value})
+
+
+def evaluate_parallel(board, engine_path, limit, workers=None, options=None):
+    """
+    Same result as evaluate with legal moves spread over workers engines leased from engine_pool.
+    """
+    moves = queue.Queue()
+    for mov in board.legal_moves:
+        moves.put(mov)
+
+    workers = max(1, min(workers or os.cpu_count(), moves.qsize()))
+    engine_pool.reserve(workers)
+
+    def work():
+        worker_board = board.copy()
+        res = {}
+        with engine_pool.lease(engine_path, options) as engine:
+            while True:
+                try:
+                    mov = moves.get(block=False)
+                except queue.Empty:
+                    return res
+
+                worker_board.push(mov)
+                key = mov.uci()
+                res[key] = {}
+                analysis = engine.analysis(worker_board, limit)
+                for info in analysis:
+                    if 'depth' in info and 'score' in info:
+                        res[key][info['depth']] = info['score']
+
+                worker_board.pop()
+
+    res = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for worker_res in executor.map(lambda _: work(), range(workers)):
+            res.update(worker_res)
+
+    return Evaluation(board.turn, res)
+
+
 class Selector(ABC):
     @abstractmethod
     def select_move(self, evaluation):
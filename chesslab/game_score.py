@@ -22,13 +22,23 @@ def cmp_score(best_score, score, mate_score=1000):
 
 
 class GameScore:
-    def __init__(self, game, engine, limit):
+    def __init__(self, game, engine, limit, single_pass=False, multipv=3, verbose=True):
         self.engine = engine
         self.game = game
         self.board = game.board()
         self.limit = limit
+        self.single_pass = single_pass
+        self.multipv = multipv
+        self.verbose = verbose
+
+    def progress(self, text='.'):
+        if self.verbose:
+            sys.stdout.write(text)
 
     def evaluate(self):
+        if self.single_pass:
+            return self.evaluate_single_pass()
+
         self.board = self.game.board()
         res = {'white': [], 'black': []}
         for i, move in enumerate(self.game.mainline_moves()):
@@ -36,8 +46,8 @@ class GameScore:
             r = self.diff(move)
             res[color].append(r)
             self.board.push(move)
-            sys.stdout.write('.')
-        print("")
+            self.progress()
+        self.progress('\n')
         return res
 
     def score(self):
@@ -58,3 +68,30 @@ class GameScore:
         score = res['score'].pov(color)
         self.board.pop()
         return cmp_score(best_score, score)
+
+    def evaluate_single_pass(self):
+        """
+        One multipv root search per ply. The best move score comes from the root lines,
+        the played move score from its root line or, when the played move is not among them,
+        from the root search of the next ply.
+        """
+        self.board = self.game.board()
+        res = {'white': [], 'black': []}
+        root = self.engine.analyse(self.board, self.limit, multipv=self.multipv)
+        moves = list(self.game.mainline_moves())
+        for i, move in enumerate(moves):
+            color = self.board.turn
+            best_score = root[0]['score'].pov(color)
+            played = [info for info in root if info.get('pv') and info['pv'][0] == move]
+            self.board.push(move)
+            if i + 1 < len(moves):
+                root = self.engine.analyse(self.board, self.limit, multipv=self.multipv)
+                next_score = root[0]['score']
+            elif not played:
+                next_score = self.engine.analyse(self.board, self.limit)['score']
+
+            score = played[0]['score'].pov(color) if played else next_score.pov(color)
+            res['white' if color else 'black'].append(cmp_score(best_score, score))
+            self.progress()
+        self.progress('\n')
+        return res
@@ -0,0 +1,69 @@
+import struct
+from multiprocessing import shared_memory
+
+
+class ImageHandle:
+    """
+    Position of an image in ImageRing, small enough to send through a queue instead of the image.
+    """
+    def __init__(self, slot, seq, length):
+        self.slot = slot
+        self.seq = seq
+        self.length = length
+
+
+class ImageRing:
+    """
+    Ring of fixed size slots in shared memory for passing images from one writer to readers in other processes.
+    Each slot starts with the sequence number of the image written to it, which is zeroed while the image
+    is being overwritten. A reader copies the image and checks that the number did not change,
+    so an image overwritten before it was read is dropped rather than shown torn.
+    The ring is created without name and attached to in other processes by its name,
+    the number and size of slots are kept at the start of the shared memory.
+    """
+    header = struct.Struct('<QQ')
+
+    def __init__(self, name=None, slots=8, slot_size=1 << 22):
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.header.size + slots * slot_size)
+            self.header.pack_into(self.shm.buf, 0, slots, slot_size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.slots, self.slot_size = self.header.unpack_from(self.shm.buf, 0)
+        self.seq = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, data):
+        """
+        ImageHandle of data written to the next slot, None if data does not fit in a slot.
+        """
+        if len(data) > self.slot_size - self.header.size:
+            return None
+
+        self.seq += 1
+        slot = self.seq % self.slots
+        offset = self.header.size + slot * self.slot_size
+        start = offset + self.header.size
+        self.header.pack_into(self.shm.buf, offset, 0, len(data))
+        self.shm.buf[start:start + len(data)] = data
+        self.header.pack_into(self.shm.buf, offset, self.seq, len(data))
+        return ImageHandle(slot, self.seq, len(data))
+
+    def read(self, handle):
+        """
+        Image bytes, None if the image was overwritten.
+        """
+        offset = self.header.size + handle.slot * self.slot_size
+        start = offset + self.header.size
+        data = bytes(self.shm.buf[start:start + handle.length])
+        seq, _ = self.header.unpack_from(self.shm.buf, offset)
+        return data if seq == handle.seq else None
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
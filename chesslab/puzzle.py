@@ -1,25 +1,129 @@
+import os
+import time
+import sqlite3
+import threading
 import chess
 import chess.pgn
+import chess.polyglot
 from chess import Board, Move, Color
+from chess.engine import Limit
+from chesslab.engine import engine_pool
+
+
+class VerdictCache:
+    """
+    Verdicts on moves other than the puzzle solution keyed by Zobrist hash of the position and the move,
+    kept in memory and in sqlite. Latency of checks is recorded by how the verdict was found.
+    """
+    program_data_path = os.path.join(os.path.expanduser('~'), '.chesslab')
+    db_path = os.path.join(program_data_path, 'puzzle_verdicts.db')
+
+    def __init__(self, path=None):
+        self.path = path or self.db_path
+        self.memory = {}
+        self.con = None
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.last = None
+
+    def connect(self):
+        if self.con is None:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.mkdir(os.path.dirname(self.path))
+            self.con = sqlite3.connect(self.path, check_same_thread=False)
+            self.con.execute("CREATE TABLE IF NOT EXISTS verdicts (hash TEXT, move TEXT, verdict INTEGER, PRIMARY KEY (hash, move))")
+            self.con.commit()
+        return self.con
+
+    def get(self, zobrist, uci):
+        key = (zobrist, uci)
+        with self.lock:
+            if key not in self.memory:
+                row = self.connect().execute("SELECT verdict FROM verdicts WHERE hash = ? AND move = ?",
+                                             (f"{zobrist:016x}", uci)).fetchone()
+                if row is None:
+                    return None
+                self.memory[key] = bool(row[0])
+            return self.memory[key]
+
+    def put(self, zobrist, uci, verdict):
+        with self.lock:
+            self.memory[(zobrist, uci)] = verdict
+            self.connect().execute("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?)", (f"{zobrist:016x}", uci, int(verdict)))
+            self.con.commit()
+
+    def report(self, source, start, verdict):
+        latency = time.perf_counter() - start
+        self.last = (source, verdict, latency)
+        count, total = self.latencies.get(source, (0, 0.0))
+        self.latencies[source] = (count + 1, total + latency)
+        return verdict
+
+    def stats(self):
+        return " ".join(f"{source}: {count} checks avg {1000 * total / count:.1f} ms"
+                        for source, (count, total) in self.latencies.items())
+
+
+verdict_cache = VerdictCache()
 
 
 class Puzzle:
+    """
+    Keeps FEN and UCI moves as read from the database,
+    moves, board, SAN and FEN after the first move are computed on first use.
+    """
+    __slots__ = ('puzzle_id', 'title', 'db_fen', 'uci_moves_string', 'flipped', '_moves', '_board', '_moves_san')
+
     def __init__(self, puzzle_id, fen, uci_moves_string, title=str(), flipped=False):
         self.puzzle_id = puzzle_id
-        self.title=title
-        uci_moves = uci_moves_string.split()
-        self.moves = [Move.from_uci(move) for move in uci_moves]
-
+        self.title = title
         self.db_fen = fen
-        self.board = Board(fen)
-        self.first_move = self.moves[0]
-
-        self.moves_san = self.moves_to_san()
-        self.first_move_san = self.moves_san[0]
+        self.uci_moves_string = uci_moves_string
         self.flipped = flipped
-
-        self.board.push(self.first_move)
-        self.fen = self.board.fen()
+        self._moves = None
+        self._board = None
+        self._moves_san = None
+
+    def __getstate__(self):
+        return {'puzzle_id': self.puzzle_id, 'title': self.title, 'db_fen': self.db_fen,
+                'uci_moves_string': self.uci_moves_string, 'flipped': self.flipped}
+
+    def __setstate__(self, state):
+        if 'uci_moves_string' not in state:
+            # pickled before puzzles were lazy
+            state = dict(state, uci_moves_string=" ".join(move.uci() for move in state['moves']))
+        self.__init__(state['puzzle_id'], state['db_fen'], state['uci_moves_string'], state['title'], state['flipped'])
+
+    @property
+    def moves(self):
+        if self._moves is None:
+            self._moves = [Move.from_uci(move) for move in self.uci_moves_string.split()]
+        return self._moves
+
+    @property
+    def first_move(self):
+        return self.moves[0]
+
+    @property
+    def board(self):
+        if self._board is None:
+            self._board = Board(self.db_fen)
+            self._board.push(self.first_move)
+        return self._board
+
+    @property
+    def fen(self):
+        return self.board.fen()
+
+    @property
+    def moves_san(self):
+        if self._moves_san is None:
+            self._moves_san = self.moves_to_san()
+        return self._moves_san
+
+    @property
+    def first_move_san(self):
+        return self.moves_san[0]
 
     def get_turn_name(self):
         return 'white' if self.board.turn else 'black'
@@ -36,8 +140,37 @@ class Puzzle:
         pgn_string = game.accept(exporter)
         return pgn_string
 
-    def check_solution(self, move_san):
-        return self.board.parse_san(move_san) == self.moves[1]
+    def check_solution(self, move_san, engine_path=None, limit=Limit(depth=12), cache=verdict_cache):
+        """
+        True for the solution move or another move which mates as well.
+        A verdict on another move is looked up in cache, otherwise found with a short search
+        of the engine_path engine and stored. Without engine_path only immediate mates are found.
+        The latency of the check is in cache.last.
+        """
+        start = time.perf_counter()
+        move = self.board.parse_san(move_san)
+        if move == self.moves[1]:
+            return cache.report('solution', start, True)
+
+        zobrist = chess.polyglot.zobrist_hash(self.board)
+        verdict = cache.get(zobrist, move.uci())
+        if verdict is not None:
+            return cache.report('cache', start, verdict)
+
+        board = self.board.copy(stack=False)
+        board.push(move)
+        if board.is_checkmate():
+            cache.put(zobrist, move.uci(), True)
+            return cache.report('mate', start, True)
+        if engine_path is None:
+            return cache.report('no engine', start, False)
+
+        with engine_pool.lease(engine_path, game=self.puzzle_id) as engine:
+            score = engine.analyse(board, limit, 1)[0].score.pov(self.board.turn)
+        verdict = score.is_mate() and score.mate() > 0
+
+        cache.put(zobrist, move.uci(), verdict)
+        return cache.report('engine', start, verdict)
 
     def moves_to_san(self):
         moves_san = []
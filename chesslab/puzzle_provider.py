@@ -1,38 +1,248 @@
+import os
+import queue
 import random
-import pandas as pd
+import sqlite3
+import threading
+from collections import deque
+import numpy as np
 from chesslab.puzzle import Puzzle
 
 
+class PuzzleRepository:
+    """
+    Puzzles table behind one long-lived connection with an in-memory index
+    of (rating, popularity, nbplays, rowid) sorted by rating.
+    The index is cached next to the database in <db_path>.index.npy, keyed in <db_path>.index.key
+    by the state of the puzzles table, as other tables of the database such as verdicts are written to.
+    """
+    RATING, POPULARITY, NBPLAYS, ROWID = range(4)
+    repositories = {}
+
+    @classmethod
+    def open(cls, db_path, table_name, tags_table_name=None):
+        key = (db_path, table_name)
+        if key not in cls.repositories:
+            cls.repositories[key] = cls(db_path, table_name, tags_table_name)
+        return cls.repositories[key]
+
+    def __init__(self, db_path, table_name, tags_table_name=None):
+        self.db_path = db_path
+        self.table_name = table_name
+        self.tags_table_name = tags_table_name
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.index = self.load_index()
+        self.themes_cache = {}
+        self.broken = self.flagged()
+
+    def index_key(self):
+        """
+        Puzzles table name, its last rowid and the chesslab_meta rows of the database build if there are any.
+        """
+        max_rowid, = self.con.execute(f"SELECT max(rowid) FROM {self.table_name}").fetchone()
+        meta = []
+        if self.con.execute("SELECT 1 FROM sqlite_master WHERE name = 'chesslab_meta'").fetchone() is not None:
+            meta = sorted(self.con.execute("SELECT key, value FROM chesslab_meta"))
+        return repr((self.table_name, max_rowid, meta))
+
+    def load_index(self):
+        index_path = self.db_path + '.index.npy'
+        key_path = self.db_path + '.index.key'
+        key = self.index_key()
+        if os.path.isfile(index_path) and os.path.isfile(key_path):
+            with open(key_path) as f:
+                if f.read() == key:
+                    return np.load(index_path)
+
+        rows = self.con.execute(f"SELECT Rating, Popularity, NbPlays, rowid FROM {self.table_name}").fetchall()
+        index = np.array(rows, dtype=np.int32).reshape(-1, 4)
+        index = index[np.argsort(index[:, self.RATING], kind='stable')]
+        if os.path.isfile(key_path):
+            os.remove(key_path)
+        np.save(index_path, index)
+        # the key is written last, an index cut short by a crash is rebuilt
+        with open(key_path, 'w') as f:
+            f.write(key)
+        return index
+
+    def create_set(self, rating, min_popularity=60, min_nbplays=25, themes=None):
+        """
+        rowids of puzzles rated within 50 points of rating, optionally matching themes query.
+        """
+        ratings = self.index[:, self.RATING]
+        lo = np.searchsorted(ratings, rating - 50, side='right')
+        hi = np.searchsorted(ratings, rating + 50, side='left')
+        rows = self.index[lo:hi]
+        mask = (rows[:, self.POPULARITY] > min_popularity) & (rows[:, self.NBPLAYS] > min_nbplays)
+        rowids = np.setdiff1d(rows[mask, self.ROWID], self.broken)
+        if themes:
+            rowids = np.intersect1d(rowids, self.find(themes))
+        return rowids
+
+    def flagged(self, verdicts=('broken', 'error')):
+        """
+        Sorted rowids of puzzles given one of verdicts by verify_puzzles, empty if puzzles were not verified.
+        """
+        verification_table_name = f"{self.table_name}_verification"
+        with self.lock:
+            if self.con.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (verification_table_name,)).fetchone() is None:
+                return np.empty(0, dtype=np.int32)
+            cursor = self.con.execute(f"SELECT rowid FROM {verification_table_name} WHERE Verdict IN ({', '.join('?' * len(verdicts))}) "
+                                      f"ORDER BY rowid", verdicts)
+            return np.fromiter((rowid for rowid, in cursor), dtype=np.int32)
+
+    def find(self, themes):
+        """
+        Sorted rowids of puzzles matching FTS5 query over Themes and OpeningTags e.g. fork AND endgame.
+        """
+        if themes not in self.themes_cache:
+            with self.lock:
+                cursor = self.con.execute(f"SELECT rowid FROM {self.tags_table_name} WHERE {self.tags_table_name} MATCH ? ORDER BY rowid",
+                                          (themes,))
+                self.themes_cache = {themes: np.fromiter((rowid for rowid, in cursor), dtype=np.int32)}
+        return self.themes_cache[themes]
+
+    def get(self, rowid):
+        with self.lock:
+            row = self.con.execute(f"SELECT PuzzleId, FEN, Moves, Rating, GameUrl FROM {self.table_name} WHERE rowid = ?",
+                                   (int(rowid),)).fetchone()
+        return self.puzzle(row)
+
+    def get_by_id(self, puzzle_id):
+        with self.lock:
+            row = self.con.execute(f"SELECT PuzzleId, FEN, Moves, Rating, GameUrl FROM {self.table_name} WHERE PuzzleId = ?",
+                                   (puzzle_id,)).fetchone()
+        if row is None:
+            raise Exception(f"puzzle {puzzle_id} not found")
+        return self.puzzle(row)
+
+    @staticmethod
+    def puzzle(row):
+        puzzle_id, fen, moves, rating, url = row
+        title = f"{url} ({rating})"
+        return Puzzle(puzzle_id=puzzle_id, fen=fen, uci_moves_string=moves, title=title)
+
+
+class PuzzleSampler:
+    """
+    Draws rowids from weighted training sets with Vose's alias method over the sets
+    and uniformly within a set. Rowids drawn within the last window draws are redrawn,
+    remembered in a bitset indexed by rowid. The same seed gives the same sequence.
+    """
+    max_redraws = 32
+
+    def __init__(self, training_sets, weights, seed=None, window=1000):
+        self.training_sets = [np.asarray(training_set) for training_set in training_sets]
+        self.rng = np.random.default_rng(seed)
+        self.prob, self.alias = self.alias_table(weights)
+        self.window = window
+        self.recent = deque()
+        max_rowid = max((int(training_set.max()) for training_set in self.training_sets if len(training_set)), default=0)
+        self.seen = np.zeros((max_rowid >> 3) + 1, dtype=np.uint8)
+
+    @staticmethod
+    def alias_table(weights):
+        n = len(weights)
+        scaled = np.asarray(weights, dtype=float) * n / sum(weights)
+        prob = np.ones(n)
+        alias = np.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            i, j = small.pop(), large.pop()
+            prob[i] = scaled[i]
+            alias[i] = j
+            scaled[j] += scaled[i] - 1
+            (small if scaled[j] < 1 else large).append(j)
+
+        return prob, alias
+
+    def is_recent(self, rowid):
+        return self.seen[rowid >> 3] & (1 << (rowid & 7))
+
+    def remember(self, rowid):
+        self.seen[rowid >> 3] |= 1 << (rowid & 7)
+        self.recent.append(rowid)
+        if len(self.recent) > self.window:
+            oldest = self.recent.popleft()
+            self.seen[oldest >> 3] &= ~(1 << (oldest & 7)) & 0xff
+
+    def draw(self):
+        i = self.rng.integers(len(self.prob))
+        if self.rng.random() >= self.prob[i]:
+            i = self.alias[i]
+        training_set = self.training_sets[i]
+        return int(training_set[self.rng.integers(len(training_set))])
+
+    def next(self):
+        for _ in range(self.max_redraws):
+            rowid = self.draw()
+            if not self.is_recent(rowid):
+                break
+        self.remember(rowid)
+        return rowid
+
+
 class PuzzleProvider:
     @classmethod
     def create_set(cls, df, rating, min_popularity=60, min_nbplays=25):
         return df[(df.Rating > rating - 50) & (df.Rating < rating + 50) & (df.Popularity > min_popularity) & (df.NbPlays > min_nbplays)]
 
-    @classmethod
-    def create_set_from_sqlite(cls, con, table_name, rating, min_popularity=60, min_nbplays=25):
-        df = pd.read_sql(f"SELECT PuzzleId FROM {table_name} WHERE Rating > {rating - 50} AND Rating < {rating + 50} AND Popularity > {min_popularity} AND NbPlays > {min_nbplays};", con)
-        return df
-
-    def __init__(self, training_sets, weights):
+    def __init__(self, training_sets, weights, repository, seed=None, window=1000, prefetch=8):
         self.training_sets = training_sets
         self.weights = weights
+        self.repository = repository
+        self.sampler = PuzzleSampler(training_sets, weights, seed, window)
+        self.prefetch = prefetch
+        self.buffer = queue.Queue(maxsize=max(prefetch, 1))
+        self.stopped = threading.Event()
+        self.thread = None
 
         self.rnd_flipped = False
 
-    def next_puzzle(self, con, table_name):
-        training_set, = random.choices(self.training_sets, weights=self.weights, k=1)
-        sample = training_set.sample()
-        puzzle_id = sample['PuzzleId'].values[0]
-        return self.get_puzzle(con, table_name, puzzle_id)
-
-    def get_puzzle(self, con, table_name, puzzle_id):
-        sample = pd.read_sql(f"SELECT * FROM {table_name} WHERE PuzzleId = '{puzzle_id}'", con)
-        fen = sample['FEN'].values[0]
-        moves = sample['Moves'].values[0]
-        rating = sample['Rating'].values[0]
-        url = sample['GameUrl'].values[0]
-        title = f"{url} ({rating})"
-        puzzle = Puzzle(puzzle_id=puzzle_id, fen=fen, uci_moves_string=moves, title=title)
+    def decode_next(self):
+        puzzle = self.repository.get(self.sampler.next())
+        puzzle.flipped = bool(self.rnd_flipped and self.sampler.rng.integers(2))
+        return puzzle
+
+    def prefetch_loop(self):
+        """
+        Keeps the buffer filled with the next prefetch decoded puzzles.
+        An exception decoding a puzzle is put to the buffer instead and ends the loop.
+        """
+        while not self.stopped.is_set():
+            try:
+                puzzle = self.decode_next()
+            except Exception as e:
+                puzzle = e
+            while not self.stopped.is_set():
+                try:
+                    self.buffer.put(puzzle, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if isinstance(puzzle, Exception):
+                return
+
+    def next_puzzle(self):
+        if self.prefetch <= 0:
+            return self.decode_next()
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.prefetch_loop, daemon=True)
+            self.thread.start()
+
+        puzzle = self.buffer.get()
+        if isinstance(puzzle, Exception):
+            # the prefetch thread ended, the next call starts it again
+            self.thread = None
+            raise puzzle
+        return puzzle
+
+    def get_puzzle(self, puzzle_id):
+        puzzle = self.repository.get_by_id(puzzle_id)
         puzzle.flipped = False if not self.rnd_flipped else random.choice([False, True])
         return puzzle
 
+    def close(self):
+        self.stopped.set()
@@ -0,0 +1,139 @@
+import time
+import sqlite3
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
+import chess
+from chess.engine import SimpleEngine, Limit, EngineError
+from chesslab.puzzle import Puzzle
+
+MATE_SCORE = 100000
+VERDICTS = ('ok', 'ambiguous', 'broken', 'error')
+
+worker_engine = None
+
+
+def verify_puzzle(puzzle, engine, limit, margin=150):
+    """
+    Check every solver move of the puzzle with a multipv 2 search.
+    A solution move must be the best move and better than the second best by margin centipawns,
+    otherwise the puzzle is ambiguous, or broken if another move is better by margin.
+    Returns (verdict, ply, move, alternative, gap) of the worst solver move,
+    gap is the score of the solution move minus the score of the alternative.
+    """
+    res = ('ok', None, None, None, None)
+    board = chess.Board(puzzle.db_fen)
+    for ply, move in enumerate(puzzle.moves):
+        if ply % 2 == 1:
+            infos = [info for info in engine.analyse(board, limit, multipv=2) if info.get('pv')]
+            scores = {info['pv'][0]: info['score'].pov(board.turn).score(mate_score=MATE_SCORE) for info in infos}
+            best = infos[0]['pv'][0]
+            if best == move:
+                if len(infos) > 1:
+                    alternative = infos[1]['pv'][0]
+                    gap = scores[move] - scores[alternative]
+                    if gap < margin and res[0] == 'ok':
+                        res = ('ambiguous', ply, move.uci(), alternative.uci(), gap)
+            else:
+                if move not in scores:
+                    info = engine.analyse(board, limit, root_moves=[move])
+                    scores[move] = info['score'].pov(board.turn).score(mate_score=MATE_SCORE)
+                gap = scores[move] - scores[best]
+                if gap <= -margin:
+                    return 'broken', ply, move.uci(), best.uci(), gap
+                if res[0] == 'ok':
+                    res = ('ambiguous', ply, move.uci(), best.uci(), gap)
+
+        board.push(move)
+
+    return res
+
+
+def init_verify_worker(engine_path, options):
+    global worker_engine
+    worker_engine = SimpleEngine.popen_uci(engine_path)
+    if options:
+        worker_engine.configure(options)
+    Finalize(None, worker_engine.quit, exitpriority=10)
+
+
+def verify_worker(task):
+    rowid, puzzle_id, fen, moves, limit, margin = task
+    try:
+        return (rowid, puzzle_id) + verify_puzzle(Puzzle(puzzle_id, fen, moves), worker_engine, limit, margin)
+    except (ValueError, IndexError, EngineError):
+        return rowid, puzzle_id, 'error', None, None, None, None
+
+
+def verify_tasks(db_path, select, limit, margin, checkpoint, count):
+    """
+    Tasks of puzzles not verified yet read page by page. The pool iterates tasks on its own thread,
+    so they are read through a connection of that thread.
+    """
+    con = sqlite3.connect(db_path)
+    try:
+        last_rowid = 0
+        remaining = count
+        while remaining is None or remaining > 0:
+            size = checkpoint if remaining is None else min(checkpoint, remaining)
+            rows = con.execute(select, (last_rowid, size)).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+            for row in rows:
+                yield row + (limit, margin)
+    finally:
+        con.close()
+
+
+def verify_puzzles(db_path, table_name, engine_path, limit=Limit(time=0.5), margin=150, workers=None, options=None,
+                   checkpoint=200, count=None, overwrite=False):
+    """
+    Verify puzzles in a pool of worker processes, each with its own engine.
+    Verdicts are written to the <table_name>_verification side table every checkpoint puzzles as they arrive,
+    puzzles already verified are skipped unless overwrite, so an interrupted run resumes.
+    At most count puzzles are verified in one run.
+    """
+    verification_table_name = f"{table_name}_verification"
+    con = sqlite3.connect(db_path)
+    try:
+        with con:
+            if overwrite:
+                con.execute(f"DROP TABLE IF EXISTS {verification_table_name}")
+            con.execute(f"CREATE TABLE IF NOT EXISTS {verification_table_name} (rowid INTEGER PRIMARY KEY, PuzzleId TEXT, "
+                        f"Verdict TEXT, Ply INTEGER, Move TEXT, Alternative TEXT, Gap INTEGER)")
+
+        select = (f"SELECT rowid, PuzzleId, FEN, Moves FROM {table_name} "
+                  f"WHERE rowid > ? AND rowid NOT IN (SELECT rowid FROM {verification_table_name}) ORDER BY rowid LIMIT ?")
+        insert = f"INSERT OR REPLACE INTO {verification_table_name} VALUES (?, ?, ?, ?, ?, ?, ?)"
+        start = time.time()
+        done = 0
+        verdicts = dict.fromkeys(VERDICTS, 0)
+        results = []
+
+        def save():
+            nonlocal done
+            with con:
+                con.executemany(insert, results)
+            done += len(results)
+            results.clear()
+            elapsed = time.time() - start
+            print(f"{done} puzzles {round(elapsed)} sec ({3600 * done / max(elapsed, 1e-9):.0f} puzzles/hour) {verdicts}")
+
+        tasks = verify_tasks(db_path, select, limit, margin, checkpoint, count)
+        with Pool(processes=workers, initializer=init_verify_worker, initargs=(engine_path, options)) as pool:
+            # workers are kept busy, a slow puzzle does not hold back the results of the others
+            for result in pool.imap_unordered(verify_worker, tasks):
+                results.append(result)
+                verdicts[result[2]] += 1
+                if len(results) >= checkpoint:
+                    save()
+            if results:
+                save()
+            pool.close()
+            pool.join()
+    finally:
+        con.close()
+
+    return verdicts
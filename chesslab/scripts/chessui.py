@@ -1,34 +1,25 @@
-import time
-import io
 import os
 import asyncio
-import sys
-import sys
 import traceback
-from importlib.resources import files
 
-import cairosvg
-import chess
-import chess.svg
 import tkinter as tk
-from tkinter import ttk
 from tkinter import scrolledtext, font
-import subprocess
-from multiprocessing import Process, Queue
+from multiprocessing import Process, Queue, Pipe
 from queue import Empty
-from chesslab.apps import MainApp, Payload
+from chesslab.apps import MainApp, Payload, RenderWorker
 from chesslab.apps.poslab import PosLab
+from chesslab.apps.poslab.reply_analyser import reply_analyser
 from chesslab.apps.tactics import TacticsLab
 from chesslab.apps.chessworld import ChessWorld
+from chesslab.apps.chessworld.ponder import ponderer
 from chesslab.scripts import init
 from chesslab.ecb import ECB
 from chesslab.command import ChesslabCommand
+from chesslab.engine import engine_pool
+from chesslab.engine.cache import analysis_cache
+from chesslab.image_ring import ImageRing
 import chesslab.assets.img
 
-def convert_svg_to_png(svg_string):
-    output = io.BytesIO()
-    cairosvg.svg2png(bytestring=svg_string, write_to=output)
-    return output
 
 def inheritors(klass):
     subclasses = set()
@@ -45,15 +36,47 @@ def inheritors(klass):
 apps = {cls.cmd: cls for cls in inheritors(MainApp)}
 
 
-def chesslab_logic_processor(in_queue, out_queue):
+class WakingQueue:
+    """
+    Queue which writes a byte to the waker connection after each put, so the UI waits on the read end
+    of the pipe with a Tk file handler rather than polling the queue.
+    """
+    def __init__(self, queue, waker=None):
+        self.queue = queue
+        self.waker = waker
+
+    def put(self, obj):
+        self.queue.put(obj)
+        if self.waker is not None:
+            try:
+                self.waker.send_bytes(b'\0')
+            except BlockingIOError:
+                # the pipe is full of wakeups the UI has not read yet
+                pass
+
+
+def chesslab_logic_processor(in_queue, out_queue, image_ring_name=None):
+    try:
+        chesslab_logic_loop(in_queue, out_queue, image_ring_name)
+    finally:
+        # engine threads are joined when the process exits, engines left running would keep it alive
+        ponderer.close()
+        reply_analyser.close()
+        engine_pool.close()
+
+
+def chesslab_logic_loop(in_queue, out_queue, image_ring_name=None):
+    render_worker = RenderWorker(out_queue, ImageRing(image_ring_name) if image_ring_name else None)
+    send = render_worker.send
     app = MainApp.app()
     app.apps = apps
     # make sure pickle object is compatible with code version
     app = app.create_from(app)
+    analysis_cache.use_disk(app.cache_disk)
 
     # out_queue.put(app.start())
     for payload in app.start():
-        out_queue.put(payload)
+        send(payload)
 
     while True:
         chesslab_command = in_queue.get()
@@ -71,45 +94,48 @@ def chesslab_logic_processor(in_queue, out_queue):
 
         if cmd == 'load':
             app.save_snapshot('autosave')
+            app.leave()
             app = app.load_snapshot(value)
             # out_queue.put(app.start())
             for payload in app.start():
-                out_queue.put(payload)
-            out_queue.put(Payload.terminal())
+                send(payload)
+            send(Payload.terminal())
             continue
 
         if cmd in apps:
             app.save_snapshot('autosave')
+            app.leave()
             app = apps[cmd](app)
             # out_queue.put(app.start())
             for payload in app.start():
-                out_queue.put(payload)
-            out_queue.put(Payload.terminal())
+                send(payload)
+            send(Payload.terminal())
             continue
 
         if cmd == 'exit':
             if not app.can_exist:
-                out_queue.put(app.payload("can't exit now"))
-                out_queue.put(Payload.terminal())
+                send(app.payload("can't exit now"))
+                send(Payload.terminal())
                 continue
             app.save_snapshot('autosave')
+            app.leave()
             app = app.exit()
             # out_queue.put(app.start())
             for payload in app.start():
-                out_queue.put(payload)
-            out_queue.put(Payload.terminal())
+                send(payload)
+            send(Payload.terminal())
             continue
 
         try:
             for output in app.execute(cmd, value, mode=chesslab_command.cmd):
-                out_queue.put(output)
+                send(output)
         except Exception as e:
             if app.debug:
                 output = Payload.terminal(text=traceback.format_exc())
             else:
                 output = Payload.terminal(text=repr(e))
 
-            out_queue.put(output)
+            send(output)
 
 
 def electronic_chessboard_communication(ec_in_queue, in_queue, out_queue):
@@ -132,12 +158,19 @@ def main():
     in_queue = Queue()
     out_queue = Queue()
 
+    # Tk file handlers are not available on Windows
+    wakeup, waker = Pipe(duplex=False) if os.name != 'nt' else (None, None)
+    if waker is not None:
+        os.set_blocking(waker.fileno(), False)
+    waking_queue = WakingQueue(out_queue, waker)
+
     ec_in_queue = Queue()
+    image_ring = ImageRing()
 
-    chesslab_logic_process = Process(target=chesslab_logic_processor, args=(in_queue, out_queue))
+    chesslab_logic_process = Process(target=chesslab_logic_processor, args=(in_queue, waking_queue, image_ring.name))
     chesslab_logic_process.start()
 
-    electronic_chessboard_process = Process(target=electronic_chessboard_communication, args=(ec_in_queue, in_queue, out_queue))
+    electronic_chessboard_process = Process(target=electronic_chessboard_communication, args=(ec_in_queue, in_queue, waking_queue))
     electronic_chessboard_process.start()
 
     root = tk.Tk()
@@ -168,9 +201,14 @@ def main():
     root.grid_columnconfigure(1, weight=1)
 
     payload = out_queue.get()
+    if wakeup is not None:
+        wakeup.recv_bytes()
 
-    image = tk.PhotoImage(data=payload.img_data)
-    image_label.config(image=image)
+    img_data = payload.get_img_data(image_ring)
+    if img_data is not None:
+        image = tk.PhotoImage(data=img_data)
+        image_label.config(image=image)
+        image_label.image = image
 
     text_area.insert(tk.INSERT, f"{payload.text}\n")
 
@@ -205,34 +243,68 @@ def main():
         return 'break'
 
     time_step = 10
-
-    def receiver():
-        try:
-            payload = out_queue.get(block=False)
-        except Empty as e:
-            payload = None
-
-        if payload is not None:
-            if payload.text is not None:
-                text_area.mark_set(tk.INSERT, tk.END)
-                text_area.insert(tk.INSERT, f"{payload.text}\n")
-                text_area.see(tk.END)
-            if payload.img_data is not None:
-                image = tk.PhotoImage(data=payload.img_data)
-                image_label.config(image=image)
-                image_label.image = image
-            if payload.last:
-                entry.config(state=tk.NORMAL)
-                entry.delete(0, tk.END)
-
+    max_batch = 1000
+
+    def apply(payloads):
+        texts = [payload.text for payload in payloads if payload.text is not None]
+        if texts:
+            text_area.mark_set(tk.INSERT, tk.END)
+            text_area.insert(tk.INSERT, "".join(f"{text}\n" for text in texts))
+            text_area.see(tk.END)
+
+        # only the last image of a burst is shown
+        image_payload = next((payload for payload in reversed(payloads) if payload.has_image()), None)
+        img_data = image_payload.get_img_data(image_ring) if image_payload is not None else None
+        if img_data is not None:
+            image = tk.PhotoImage(data=img_data)
+            image_label.config(image=image)
+            image_label.image = image
+
+        for payload in payloads:
             if payload.ecb_data is not None:
                 ec_in_queue.put(payload.ecb_data)
 
-        root.after(time_step, receiver)
+        if any(payload.last for payload in payloads):
+            entry.config(state=tk.NORMAL)
+            entry.delete(0, tk.END)
+
+    # wakeups read for payloads not got yet
+    unread = 0
+    retry = None
+
+    def drain(*args):
+        nonlocal unread, retry
+        retry = None
+        while wakeup is not None and wakeup.poll():
+            wakeup.recv_bytes()
+            unread += 1
+
+        payloads = []
+        while len(payloads) < max_batch:
+            try:
+                payloads.append(out_queue.get(block=False))
+            except Empty:
+                break
+        unread = max(unread - len(payloads), 0)
+
+        if payloads:
+            apply(payloads)
+
+        # a put is written to the queue pipe by a feeder thread after its wakeup may be read,
+        # and a burst can be larger than a batch
+        if unread and retry is None:
+            retry = root.after(time_step, drain)
 
-    entry.bind("<Return>", lambda event: execute_command())
+    def receiver():
+        drain()
+        root.after(time_step, receiver)
 
-    root.after(0, receiver)
+    # wake up when a payload was put
+    if wakeup is not None and hasattr(root.tk, 'createfilehandler'):
+        root.tk.createfilehandler(wakeup.fileno(), tk.READABLE, drain)
+        root.after(0, drain)
+    else:
+        root.after(0, receiver)
 
     # Run the application
     root.mainloop()
@@ -242,6 +314,7 @@ def main():
     in_queue.put(ChesslabCommand('term', '__exit__'))
     # p.terminate()
     chesslab_logic_process.join()
+    image_ring.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,220 @@
+import os
+import json
+import logging
+
+import numpy as np
+import chess
+import chess.pgn
+import chess.polyglot
+from chess import Move
+
+INT_COLUMNS = {'WhiteElo', 'BlackElo', 'PlyCount'}
+FLOAT_COLUMNS = {'WhiteScore', 'BlackScore'}
+DATE_COLUMNS = {'Date', 'EventDate'}
+
+
+def encode_move(move):
+    """
+    16 bit move code: from square (6 bits), to square (6 bits), promotion piece type (3 bits).
+    """
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(code):
+    code = int(code)
+    return Move(code & 0x3f, (code >> 6) & 0x3f, (code >> 12) or None)
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return -1
+
+
+def parse_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def parse_date(value):
+    """
+    1999.07.03 -> 19990703, unknown parts are zeros e.g. 1999.??.?? -> 19990000
+    """
+    res = 0
+    for part in (value.split('.') + ['??', '??'])[:3]:
+        res = 100 * res + (int(part) if part.isdigit() else 0)
+    return res
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MainlineVisitor(chess.pgn.BaseVisitor):
+    """
+    Collects headers, mainline move codes and Zobrist hashes of positions after each move.
+    Variations and comments are skipped. Errors are logged and kept in errors like GameBuilder does.
+    """
+    def begin_game(self):
+        self.headers = {}
+        self.moves = []
+        self.hashes = []
+        self.start_hash = 0
+        self.errors = []
+
+    def handle_error(self, error):
+        LOGGER.error("%s while parsing game %r", error, self.headers)
+        self.errors.append(error)
+
+    def visit_header(self, tagname, tagvalue):
+        self.headers[tagname] = tagvalue
+
+    def visit_board(self, board):
+        self.start_hash = chess.polyglot.zobrist_hash(board)
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board, move):
+        self.moves.append(encode_move(move))
+        board.push(move)
+        self.hashes.append(chess.polyglot.zobrist_hash(board))
+        board.pop()
+
+    def result(self):
+        return self
+
+
+class GameStore:
+    """
+    Columnar store of games in a directory of .npy files opened memory-mapped.
+
+    headers are typed columns: integers, floats, dates as YYYYMMDD integers
+    and other headers as category codes with categories kept in columns.json.
+    moves are 16 bit move codes of all games concatenated, hashes are Zobrist hashes
+    of positions after each move, game i moves are moves[offsets[i]:offsets[i + 1]].
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'columns.json'), encoding="utf-8") as f:
+            self.schema = json.load(f)
+        self.offsets = self.load_array('offsets')
+        self.moves = self.load_array('moves')
+        self.hashes = self.load_array('hashes')
+        self.start_hashes = self.load_array('start_hashes')
+        self.columns = {name: self.load_array(f"column_{i}") for i, name in enumerate(self.schema)}
+
+    def load_array(self, name):
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r')
+
+    @classmethod
+    def import_pgn(cls, pgn_path, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        headers = []
+        offsets = [0]
+        moves = []
+        hashes = []
+        start_hashes = []
+        with open(pgn_path, encoding="utf-8-sig") as pgn:
+            while True:
+                game = chess.pgn.read_game(pgn, Visitor=MainlineVisitor)
+                if game is None:
+                    break
+                if game.errors:
+                    # a malformed game is left out rather than stored with part of its moves
+                    continue
+                headers.append(game.headers)
+                moves.extend(game.moves)
+                hashes.extend(game.hashes)
+                start_hashes.append(game.start_hash)
+                offsets.append(len(moves))
+
+        names = sorted({name for game_headers in headers for name in game_headers})
+        schema = {}
+        for i, name in enumerate(names):
+            values = [game_headers.get(name, '') for game_headers in headers]
+            if name in INT_COLUMNS:
+                schema[name] = {'type': 'int'}
+                column = np.array([parse_int(value) for value in values], dtype=np.int32)
+            elif name in FLOAT_COLUMNS:
+                schema[name] = {'type': 'float'}
+                column = np.array([parse_float(value) for value in values], dtype=np.float32)
+            elif name in DATE_COLUMNS:
+                schema[name] = {'type': 'date'}
+                column = np.array([parse_date(value) for value in values], dtype=np.int32)
+            else:
+                categories, codes = np.unique(np.array(values, dtype=object).astype(str), return_inverse=True)
+                schema[name] = {'type': 'category', 'categories': categories.tolist()}
+                column = codes.astype(np.int32)
+            np.save(os.path.join(path, f"column_{i}.npy"), column)
+
+        np.save(os.path.join(path, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+        np.save(os.path.join(path, 'moves.npy'), np.array(moves, dtype=np.uint16))
+        np.save(os.path.join(path, 'hashes.npy'), np.array(hashes, dtype=np.uint64))
+        np.save(os.path.join(path, 'start_hashes.npy'), np.array(start_hashes, dtype=np.uint64))
+        with open(os.path.join(path, 'columns.json'), "w", encoding="utf-8") as f:
+            json.dump(schema, f)
+
+        return cls(path)
+
+    def __len__(self):
+        return len(self.start_hashes)
+
+    def column(self, name):
+        return self.columns[name]
+
+    def code(self, name, value):
+        categories = self.schema[name]['categories']
+        i = np.searchsorted(categories, value)
+        return i if i < len(categories) and categories[i] == value else -1
+
+    def values(self, name, mask=None):
+        column = self.columns[name] if mask is None else self.columns[name][mask]
+        if self.schema[name]['type'] == 'category':
+            categories = self.schema[name]['categories']
+            return [categories[code] for code in column]
+        return column
+
+    def equals(self, name, value):
+        if self.schema[name]['type'] == 'category':
+            return self.columns[name] == self.code(name, value)
+        return self.columns[name] == value
+
+    def headers(self, i):
+        res = chess.pgn.Headers({})
+        for name in self.schema:
+            value = self.columns[name][i]
+            kind = self.schema[name]['type']
+            if kind == 'category':
+                value = self.schema[name]['categories'][value]
+            elif kind == 'date':
+                value = f"{value // 10000:04d}.{value // 100 % 100:02d}.{value % 100:02d}".replace('.00', '.??')
+            elif kind == 'float':
+                value = '' if np.isnan(value) else str(round(float(value), 2))
+            elif kind == 'int':
+                value = '' if value < 0 else str(value)
+            if value:
+                res[name] = value
+        return res
+
+    def game_moves(self, i):
+        return [decode_move(code) for code in self.moves[self.offsets[i]:self.offsets[i + 1]]]
+
+    def game(self, i):
+        game = chess.pgn.Game(self.headers(i))
+        game.add_line(self.game_moves(i))
+        return game
+
+    def games_with_position(self, board):
+        """
+        Indices of games which reached the position on the board.
+        """
+        zobrist = np.uint64(chess.polyglot.zobrist_hash(board))
+        plies = np.nonzero(self.hashes == zobrist)[0]
+        games = np.searchsorted(self.offsets, plies, side='right') - 1
+        games = np.concatenate([games, np.nonzero(self.start_hashes == zobrist)[0]])
+        return np.unique(games)
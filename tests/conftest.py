@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def stub_engine(tmp_path):
+    """
+    Path of an executable running tests/stub_engine.py, engines are keyed and started by path.
+    """
+    if os.name == 'nt':
+        pytest.skip("the stub engine is started by a shell script")
+    path = tmp_path / 'stub_engine'
+    path.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(os.path.dirname(__file__), "stub_engine.py")}"\n')
+    path.chmod(0o755)
+    return str(path)
@@ -0,0 +1,75 @@
+# Minimal UCI engine for tests: scores are a checksum of position and move, lines are one move deep.
+import sys
+import zlib
+import threading
+
+import chess
+
+
+def out(text):
+    sys.stdout.write(text + "\n")
+    sys.stdout.flush()
+
+
+def score(board, move):
+    return zlib.crc32(f"{board.fen()} {move.uci()}".encode()) % 400 - 200
+
+
+def search(board, args, options, stop):
+    moves = list(board.legal_moves)
+    if 'searchmoves' in args:
+        moves = [move for move in moves if move.uci() in args[args.index('searchmoves') + 1:]]
+    if not moves:
+        out("info depth 0 score mate 0" if board.is_checkmate() else "info depth 0 score cp 0")
+        out("bestmove (none)")
+        return
+
+    depth = int(args[args.index('depth') + 1]) if 'depth' in args else 4
+    multipv = int(options.get('MultiPV', 1))
+    lines = sorted(moves, key=lambda move: -score(board, move))[:multipv]
+    for d in range(1, depth + 1):
+        for i, move in enumerate(lines):
+            out(f"info depth {d} multipv {i + 1} score cp {score(board, move)} nodes {1000 * d} pv {move.uci()}")
+    if 'infinite' in args:
+        stop.wait()
+    out(f"bestmove {lines[0].uci()}")
+
+
+def main():
+    board = chess.Board()
+    options = {}
+    stop = threading.Event()
+    thread = None
+    for line in sys.stdin:
+        parts = line.split()
+        if not parts:
+            continue
+        if parts[0] == 'uci':
+            out("id name Stub")
+            out("option name MultiPV type spin default 1 min 1 max 500")
+            out("option name Threads type spin default 1 min 1 max 64")
+            out("uciok")
+        elif parts[0] == 'isready':
+            out("readyok")
+        elif parts[0] == 'setoption':
+            options[parts[2]] = parts[4] if len(parts) > 4 else None
+        elif parts[0] == 'position':
+            moves = parts.index('moves') if 'moves' in parts else len(parts)
+            board = chess.Board() if parts[1] == 'startpos' else chess.Board(" ".join(parts[2:moves]))
+            for uci in parts[moves + 1:]:
+                board.push_uci(uci)
+        elif parts[0] == 'go':
+            stop.clear()
+            thread = threading.Thread(target=search, args=(board.copy(), parts, dict(options), stop))
+            thread.start()
+        elif parts[0] == 'stop':
+            stop.set()
+            if thread is not None:
+                thread.join()
+        elif parts[0] == 'quit':
+            stop.set()
+            break
+
+
+if __name__ == '__main__':
+    main()
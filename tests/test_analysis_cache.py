@@ -0,0 +1,69 @@
+import sqlite3
+
+import chess
+from chess.engine import Limit, PovScore, Cp
+
+from chesslab.engine.cache import AnalysisCache, engine_key
+
+
+def infos(count=1):
+    board = chess.Board()
+    moves = list(board.legal_moves)[:count]
+    return [{'score': PovScore(Cp(10 - i), chess.WHITE), 'pv': [move], 'depth': 10, 'nodes': 1000}
+            for i, move in enumerate(moves)]
+
+
+def test_engines_do_not_share_lines():
+    cache = AnalysisCache()
+    board = chess.Board()
+    cache.put(engine_key('stockfish'), board, Limit(depth=10), 1, infos())
+
+    assert cache.get(engine_key('stockfish'), board, Limit(depth=10), 1) is not None
+    assert cache.get(engine_key('stockfish', {'Threads': 2}), board, Limit(depth=10), 1) is None
+    assert cache.get(engine_key('komodo'), board, Limit(depth=10), 1) is None
+
+
+def test_deeper_search_answers_shallower_but_not_other_nodes():
+    cache = AnalysisCache()
+    board = chess.Board()
+    engine = engine_key('stockfish')
+    cache.put(engine, board, Limit(depth=12), 2, infos(2))
+    cache.put(engine, board, Limit(nodes=20000), 1, infos())
+
+    assert len(cache.get(engine, board, Limit(depth=8), 1)) == 1
+    assert cache.get(engine, board, Limit(depth=14), 1) is None
+    assert cache.get(engine, board, Limit(depth=8), 3) is None
+    assert cache.get(engine, board, Limit(nodes=20000), 1) is not None
+    assert cache.get(engine, board, Limit(nodes=5000), 1) is None
+
+
+def test_clock_limits_are_not_cached():
+    cache = AnalysisCache()
+    board = chess.Board()
+    engine = engine_key('stockfish')
+    cache.put(engine, board, Limit(depth=10), 1, infos())
+    cache.put(engine, board, Limit(white_clock=60, black_clock=60), 1, infos())
+
+    assert cache.get(engine, board, Limit(white_clock=60, black_clock=60), 1) is None
+
+
+def test_disk_keeps_engine(tmp_path):
+    path = str(tmp_path / 'analysis_cache.db')
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE analysis (hash TEXT, fields TEXT, vals TEXT, multipv INTEGER, lines TEXT)")
+    con.commit()
+    con.close()
+
+    board = chess.Board()
+    cache = AnalysisCache()
+    cache.use_disk(path=path)
+    cache.put(engine_key('stockfish'), board, Limit(depth=10), 1, infos())
+    cache.use_disk(False)
+
+    cache = AnalysisCache()
+    cache.use_disk(path=path)
+    assert cache.get(engine_key('komodo'), board, Limit(depth=10), 1) is None
+    lines = cache.get(engine_key('stockfish'), board, Limit(depth=10), 1)
+    assert lines[0]['pv'] == infos()[0]['pv']
+    assert cache.disk_hits == 1
+    cache.use_disk(False)
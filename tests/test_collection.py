@@ -0,0 +1,114 @@
+import os
+
+import chess.pgn
+
+from chesslab.collection import GameIndex, Collection
+
+
+def make_game(date, sans):
+    game = chess.pgn.Game()
+    game.headers['Date'] = date
+    node = game
+    board = chess.Board()
+    for san in sans:
+        move = board.push_san(san)
+        node = node.add_variation(move)
+    return game
+
+
+def write_pgn(path, games):
+    with open(path, 'w', encoding='utf-8') as f:
+        for game in games:
+            f.write(str(game) + '\n\n')
+
+
+def sans(game):
+    board = game.board()
+    res = []
+    for move in game.mainline_moves():
+        res.append(board.san(move))
+        board.push(move)
+    return res
+
+
+def test_offsets_and_sidecar_index(tmp_path):
+    path = str(tmp_path / 'games.pgn')
+    write_pgn(path, [make_game('2020.01.01', ['e4', 'e5']), make_game('2021.01.01', ['d4']),
+                     make_game('2022.01.01', ['c4', 'c5', 'Nc3'])])
+
+    games = GameIndex(path)
+    assert len(games) == 3
+    assert os.path.isfile(path + '.idx')
+    with open(path, 'rb') as f:
+        data = f.read()
+    for entry, date in zip(games.entries, ['2020.01.01', '2021.01.01', '2022.01.01']):
+        assert data[entry.start:entry.end].decode().startswith('[Event')
+        assert entry.headers['Date'] == date
+    assert sans(games[2]) == ['c4', 'c5', 'Nc3']
+
+    # read from the sidecar index, not scanned again
+    reloaded = GameIndex(path)
+    assert [(entry.start, entry.end) for entry in reloaded.entries] == [(entry.start, entry.end) for entry in games.entries]
+
+
+def test_headers_patched_in_place(tmp_path):
+    path = str(tmp_path / 'games.pgn')
+    write_pgn(path, [make_game('2020.01.01', ['e4', 'e5']), make_game('2021.01.01', ['d4'])])
+
+    games = GameIndex(path)
+    games[0].headers['WhiteScore'] = '0.5'
+    # the file has no room after the headers yet, the first save compacts it
+    games.save()
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        second = f.read()[games.entries[1].start:]
+
+    games[0].headers['BlackScore'] = '0.25'
+    games.save()
+    assert os.path.getsize(path) == size
+    with open(path, 'rb') as f:
+        assert f.read()[games.entries[1].start:] == second
+
+    reloaded = GameIndex(path)
+    assert reloaded[0].headers['WhiteScore'] == '0.5'
+    assert reloaded[0].headers['BlackScore'] == '0.25'
+    assert sans(reloaded[0]) == ['e4', 'e5']
+
+
+def test_reordered_and_replaced_games_compact(tmp_path):
+    path = str(tmp_path / 'games.pgn')
+    write_pgn(path, [make_game('2021.01.01', ['d4']), make_game('2020.01.01', ['e4', 'e5'])])
+
+    games = GameIndex(path, cache_size=1)
+    games[0] = make_game('2021.01.01', ['d4', 'd5', 'c4'])
+    # the replaced game waits in the pending file, not in memory
+    assert os.path.isfile(games.pending_path)
+    assert all(entry.game is None for entry in games.entries)
+    games.sort(key=lambda entry: entry.headers['Date'])
+    games.save()
+    assert not os.path.isfile(games.pending_path)
+
+    reloaded = GameIndex(path)
+    assert [entry.headers['Date'] for entry in reloaded.entries] == ['2020.01.01', '2021.01.01']
+    assert sans(reloaded[1]) == ['d4', 'd5', 'c4']
+
+
+def test_games_added_to_a_new_lazy_collection(tmp_path):
+    path = str(tmp_path / 'new.pgn')
+    collection = Collection(path, lazy=True)
+    collection.add_game(make_game('2022.01.01', ['e4']))
+    collection.add_game(make_game('2020.01.01', ['d4']))
+    collection.add_game(make_game('2021.01.01', ['c4']))
+    collection.save()
+
+    # appended at the end without rewriting the games saved before
+    with open(path, 'rb') as f:
+        before = f.read()
+    collection.add_game(make_game('2023.01.01', ['Nf3']))
+    collection.save()
+    with open(path, 'rb') as f:
+        assert f.read().startswith(before)
+
+    reloaded = Collection(path, lazy=True)
+    assert [game.headers['Date'] for game in reloaded.games] == ['2020.01.01', '2021.01.01', '2022.01.01', '2023.01.01']
+    assert sans(reloaded.games[3]) == ['Nf3']
@@ -0,0 +1,63 @@
+import chess
+import pytest
+from chess.engine import Limit, EngineError
+
+from chesslab.engine import EnginePool
+
+
+def test_released_engine_is_reused(stub_engine):
+    pool = EnginePool(max_idle=1)
+    try:
+        with pool.lease(stub_engine) as engine:
+            first = engine
+            lines = engine.analyse(chess.Board(), Limit(depth=2), 2, cache=None)
+            assert len(lines) == 2
+        with pool.lease(stub_engine) as engine:
+            assert engine is first
+        assert (pool.started, pool.reused) == (1, 1)
+    finally:
+        pool.close()
+
+
+def test_engines_are_keyed_by_options(stub_engine):
+    pool = EnginePool(max_idle=2)
+    try:
+        with pool.lease(stub_engine) as plain:
+            pass
+        with pool.lease(stub_engine, {'Threads': 2}) as threaded:
+            assert threaded is not plain
+            assert threaded.options == {'Threads': 2}
+        with pool.lease(stub_engine, {'Threads': 2}) as engine:
+            assert engine is threaded
+        assert pool.started == 2
+    finally:
+        pool.close()
+
+
+def test_engine_failing_in_lease_is_discarded(stub_engine):
+    pool = EnginePool(max_idle=1)
+    try:
+        with pytest.raises(EngineError):
+            with pool.lease(stub_engine) as engine:
+                failed = engine
+                raise EngineError("lost")
+        assert not failed.is_alive()
+        with pool.lease(stub_engine) as engine:
+            assert engine is not failed
+        assert (pool.started, pool.replaced) == (2, 1)
+    finally:
+        pool.close()
+
+
+def test_dead_idle_engine_is_replaced(stub_engine):
+    pool = EnginePool(max_idle=1)
+    try:
+        with pool.lease(stub_engine) as engine:
+            dead = engine
+        dead.quit()
+        with pool.lease(stub_engine) as engine:
+            assert engine is not dead
+            assert engine.is_alive()
+        assert pool.replaced == 1
+    finally:
+        pool.close()
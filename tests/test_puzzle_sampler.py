@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from chesslab.puzzle_provider import PuzzleSampler, PuzzleProvider
+
+
+def training_sets():
+    return [np.arange(1, 501), np.arange(1000, 1100), np.array([], dtype=np.int64)]
+
+
+def draws(seed, count=300):
+    sampler = PuzzleSampler(training_sets(), [0.7, 0.3, 0], seed=seed, window=50)
+    return [sampler.next() for _ in range(count)]
+
+
+def test_same_seed_same_sequence():
+    assert draws(2024) == draws(2024)
+    assert draws(2024) != draws(2025)
+
+
+def test_no_repeats_within_window_and_weights():
+    sequence = draws(7, 2000)
+    for i in range(len(sequence) - 50):
+        assert sequence[i] not in sequence[i + 1:i + 50]
+    second = sum(rowid >= 1000 for rowid in sequence) / len(sequence)
+    assert 0.2 < second < 0.4
+
+
+class Repository:
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.calls = 0
+
+    def get(self, rowid):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise ValueError(f"bad puzzle {rowid}")
+        return SimpleNamespace(rowid=rowid)
+
+
+def provider(repository, prefetch):
+    return PuzzleProvider(training_sets=training_sets(), weights=[0.7, 0.3, 0], repository=repository,
+                          seed=11, prefetch=prefetch)
+
+
+def test_prefetch_keeps_the_seeded_sequence():
+    direct = provider(Repository(), prefetch=0)
+    prefetched = provider(Repository(), prefetch=4)
+    try:
+        assert ([direct.next_puzzle().rowid for _ in range(20)]
+                == [prefetched.next_puzzle().rowid for _ in range(20)])
+    finally:
+        prefetched.close()
+
+
+def test_prefetch_error_is_raised_and_prefetching_resumes():
+    pp = provider(Repository(fail_at=3), prefetch=4)
+    try:
+        pp.next_puzzle()
+        pp.next_puzzle()
+        with pytest.raises(ValueError):
+            pp.next_puzzle()
+        assert pp.next_puzzle() is not None
+    finally:
+        pp.close()
@@ -0,0 +1,47 @@
+import sqlite3
+
+import chess
+from chess.engine import Limit
+
+from chesslab.puzzle_verification import verify_puzzles, VERDICTS
+
+PUZZLES = [('p1', 'e2e4 e7e5'), ('p2', 'd2d4 d7d5 c2c4 e7e6'), ('p3', 'g1f3 g8f6'), ('p4', 'c2c4 c7c5'),
+           ('p5', 'e2e4 c7c5 g1f3 d7d6')]
+
+
+def make_db(path):
+    con = sqlite3.connect(path)
+    with con:
+        con.execute("CREATE TABLE puzzles (PuzzleId TEXT, FEN TEXT, Moves TEXT)")
+        con.executemany("INSERT INTO puzzles VALUES (?, ?, ?)",
+                        [(puzzle_id, chess.STARTING_FEN, moves) for puzzle_id, moves in PUZZLES])
+    con.close()
+
+
+def verified(path):
+    con = sqlite3.connect(path)
+    try:
+        return dict(con.execute("SELECT PuzzleId, Verdict FROM puzzles_verification").fetchall())
+    finally:
+        con.close()
+
+
+def test_interrupted_run_resumes(tmp_path, stub_engine):
+    path = str(tmp_path / 'puzzles.db')
+    make_db(path)
+
+    verdicts = verify_puzzles(path, 'puzzles', stub_engine, limit=Limit(depth=2), workers=1, checkpoint=2, count=3)
+    assert sum(verdicts.values()) == 3
+    first = verified(path)
+    assert sorted(first) == ['p1', 'p2', 'p3']
+
+    # only the puzzles left are verified, verdicts saved before are kept
+    verdicts = verify_puzzles(path, 'puzzles', stub_engine, limit=Limit(depth=2), workers=1, checkpoint=2)
+    assert sum(verdicts.values()) == 2
+    second = verified(path)
+    assert sorted(second) == ['p1', 'p2', 'p3', 'p4', 'p5']
+    assert all(second[puzzle_id] == verdict for puzzle_id, verdict in first.items())
+    assert set(second.values()) <= set(VERDICTS) - {'error'}
+
+    verdicts = verify_puzzles(path, 'puzzles', stub_engine, limit=Limit(depth=2), workers=1, overwrite=True)
+    assert sum(verdicts.values()) == 5
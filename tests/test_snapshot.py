@@ -0,0 +1,66 @@
+import pickle
+
+import chess
+
+from chesslab.apps import snapshot
+
+
+class State(snapshot.Restorable):
+    def __init__(self):
+        self.board = chess.Board()
+        self.name = 'state'
+
+    def __getstate__(self):
+        return dict(self.__dict__)
+
+
+def save(app, path):
+    snapshot.save(app, path)
+    snapshot.snapshot_writer.flush()
+
+
+def test_save_after_torn_append(tmp_path):
+    path = str(tmp_path / 'state.snap')
+    app = State()
+    save(app, path)
+    app.board.push_san('e4')
+    save(app, path)
+
+    # a crash while appending leaves the start of a record
+    body = pickle.dumps(('name', 'x' * 100))
+    with open(path, 'ab') as f:
+        f.write(snapshot.record(snapshot.ATTR, body)[:snapshot.record_header.size + 10])
+    size = snapshot.SnapshotFile(path).size
+
+    app = snapshot.load(path)
+    assert [move.uci() for move in app.board.move_stack] == ['e2e4']
+    assert len(open(path, 'rb').read()) == size
+
+    app.board.push_san('e5')
+    app.name = 'changed'
+    save(app, path)
+    snapshot.journals.clear()
+
+    app = snapshot.load(path)
+    assert [move.uci() for move in app.board.move_stack] == ['e2e4', 'e7e5']
+    assert app.name == 'changed'
+
+
+def test_attributes_are_decoded_on_use(tmp_path):
+    path = str(tmp_path / 'state.snap')
+    app = State()
+    app.board.push_san('d4')
+    save(app, path)
+    snapshot.journals.clear()
+
+    app = snapshot.load(path)
+    assert 'name' not in app.__dict__ and 'board' not in app.__dict__
+    app.board.push_san('d5')
+    # a rewrite keeps the attribute not decoded
+    snapshot.journals.clear()
+    save(app, path)
+    assert 'name' not in app.__dict__
+
+    app = snapshot.load(path)
+    assert [move.uci() for move in app.board.move_stack] == ['d2d4', 'd7d5']
+    assert app.name == 'state'
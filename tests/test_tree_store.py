@@ -0,0 +1,84 @@
+import chess
+from chess.engine import PovScore, Cp
+
+from chesslab.engine import Line
+from chesslab.apps.poslab import Node, TreeStore
+
+
+def play(store, sans, engine_color=chess.BLACK):
+    board = chess.Board()
+    node = store.get(board, engine_color)
+    root = node
+    for san in sans:
+        move = board.push_san(san)
+        child = node.children.get(move.uci())
+        if child is None:
+            child = store.get(board, engine_color)
+            node.add_child(move.uci(), child)
+        node = child
+    store.flush()
+    return root, node
+
+
+def line(uci, cp):
+    return Line({'score': PovScore(Cp(cp), chess.BLACK), 'pv': [chess.Move.from_uci(uci)]})
+
+
+def test_transposition_is_one_node(tmp_path):
+    store = TreeStore(Node, str(tmp_path / 'tree.db'))
+    _, a = play(store, ['Nf3', 'Nf6', 'Nc3'])
+    _, b = play(store, ['Nc3', 'Nf6', 'Nf3'])
+    assert a is b
+
+
+def test_flushed_nodes_are_read_back(tmp_path):
+    path = str(tmp_path / 'tree.db')
+    store = TreeStore(Node, path)
+    _, node = play(store, ['e4', 'e5'])
+    node.human_success = True
+    node.lines = [line('g1f3', 30)]
+    store.flush()
+
+    store = TreeStore(Node, path)
+    root = store.get(chess.Board(), chess.BLACK)
+    node = root.children['e2e4'].children['e7e5']
+    assert node.human_success
+    assert [line.key() for line in node.lines] == ['g1f3']
+
+
+def test_forget_keeps_positions_of_other_roots(tmp_path):
+    store = TreeStore(Node, str(tmp_path / 'tree.db'))
+    root, _ = play(store, ['Nf3', 'Nf6', 'Nc3', 'Nc6'])
+    # a tree from the position after 1. Nc3 reaches the same positions by transposition
+    board = chess.Board()
+    board.push_san('Nc3')
+    other = store.get(board, chess.BLACK)
+    board.push_san('Nf6')
+    child = store.get(board, chess.BLACK)
+    other.add_child('g8f6', child)
+    board.push_san('Nf3')
+    shared = store.get(board, chess.BLACK)
+    child.add_child('g1f3', shared)
+    store.flush()
+
+    # the root, 1. Nf3 and 1. Nf3 Nf6 are deleted, 1. Nf3 Nf6 2. Nc3 is reached from the other root
+    assert store.forget(root) == 3
+    count, = store.con.execute("SELECT COUNT(*) FROM nodes").fetchone()
+    assert count == 4
+    assert store.row(shared.key) is not None
+    assert store.row(shared.children['b8c6'].key) is not None
+
+
+def test_change_below_clears_scores_above(tmp_path):
+    store = TreeStore(Node, str(tmp_path / 'tree.db'))
+    root, node = play(store, ['e4'], engine_color=chess.BLACK)
+    node.lines = [line('e7e5', 20)]
+    node.human_success = True
+    root.lines = [line('e2e4', -20)]
+    engine_color = chess.BLACK
+    assert node.eval(engine_color) == 20
+    assert root.eval(engine_color) == 20
+
+    node.lines = [line('e7e5', 50)]
+    assert root.eval_score is None
+    assert root.eval(engine_color) == 50